@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+
+#################################################
+# GATEWAYMAKER BENCHMARK
+#
+# Times each stage of making tests on synthetic
+# question banks of a chosen size, so that
+# releases can be compared.  Results are printed
+# and saved as JSON.
+#
+# Nothing here touches the real configuration
+# or question files; the synthetic bank lives in
+# a temporary directory.
+#################################################
+
+import argparse
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import tempfile
+import time
+
+import gatewaymaker
+
+
+def generateQuestionBank(bankDir, numberOfSets, filesPerSet, questionsPerFile, questionsPerSet, rng):
+    """
+    Writes synthetic question files into bankDir and returns a configuration
+    that uses them.  Questions look like the shipped ones: one line of tex
+    followed by a '%%' answer line, with the odd blank line and comment.
+
+    bankDir = directory to write the question files into
+    numberOfSets = number of question sets in the configuration
+    filesPerSet = number of question files in each set
+    questionsPerFile = number of questions in each file
+    questionsPerSet = number of questions to choose from each set
+    rng = the random.Random to make up questions with
+    """
+    config = {"question sets":[], "page breaks after questions":list(range(3, numberOfSets * questionsPerSet, 3))}
+    for setIndex in range(0, numberOfSets):
+        questionSet = {"number of questions":questionsPerSet, "question files":[]}
+        for fileIndex in range(0, filesPerSet):
+            lines = ["% synthetic question file " + str(fileIndex) + " of set " + str(setIndex)]
+            for questionIndex in range(0, questionsPerFile):
+                a, b, c = rng.randint(1, 99), rng.randint(1, 99), rng.randint(2, 9)
+                lines.append("$\\displaystyle{\\frac{" + str(a) + "x^{" + str(c) + "}}{" + str(b) + "y^{-" + str(c) + "}}}$")
+                lines.append("   %%$\\frac{" + str(a) + "}{" + str(b) + "}x^{" + str(c) + "}y^{" + str(c) + "}$%")
+                if questionIndex % 10 == 9:
+                    lines.append("")
+            questionPath = pathlib.Path(bankDir) / ("set" + str(setIndex) + "_file" + str(fileIndex) + ".tex")
+            questionPath.write_text("\n".join(lines) + "\n")
+            questionSet["question files"].append({"file path":str(questionPath), "instructions":"Simplify set " + str(setIndex) + " file " + str(fileIndex) + "."})
+        config["question sets"].append(questionSet)
+    return config
+
+def timeStage(timings, stage, function, *args):
+    """
+    Runs function(*args), adds its wall time in seconds to timings[stage] and returns its result.
+    """
+    startTime = time.perf_counter()
+    result = function(*args)
+    timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - startTime
+    return result
+
+def runBenchmark(parameters):
+    """
+    Builds a synthetic bank and times each stage of making tests from it.
+    Returns a dictionary of stage name to seconds.
+
+    parameters = dictionary with "sets", "files per set", "questions per file",
+                 "questions per set", "versions" and "seed"
+    """
+    rng = random.Random(parameters["seed"])
+    testHeader = gatewaymaker.TEST_HEADER_FILE_PATH.read_text()
+    answerHeader = gatewaymaker.ANSWER_KEY_HEADER_FILE_PATH.read_text()
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        bankDir = pathlib.Path(tempDir) / "question_files"
+        outputDir = pathlib.Path(tempDir) / "tests"
+        bankDir.mkdir()
+        outputDir.mkdir()
+        config = generateQuestionBank(bankDir, parameters["sets"], parameters["files per set"], parameters["questions per file"], parameters["questions per set"], rng)
+        filePaths = [questionFile["file path"] for questionSet in config["question sets"] for questionFile in questionSet["question files"]]
+
+        #parsing, without and then with the on-disk cache
+        questionBank = gatewaymaker.QuestionBank(None)
+        timeStage(timings, "parse", questionBank.load, filePaths)
+        cachePath = pathlib.Path(tempDir) / "question_cache.json"
+        warmingBank = gatewaymaker.QuestionBank(cachePath)
+        warmingBank.load(filePaths)
+        warmingBank.saveCache()
+        cachedBank = gatewaymaker.QuestionBank(cachePath)
+        timeStage(timings, "parse with warm cache", cachedBank.load, filePaths)
+
+        timeStage(timings, "validate", gatewaymaker.validateQuestionSets, config, questionBank)
+        testPlan = timeStage(timings, "plan", gatewaymaker.TestPlan, config, questionBank, testHeader, answerHeader)
+
+        versionSeeds = [gatewaymaker.deriveVersionSeed(parameters["seed"], i) for i in range(0, parameters["versions"])]
+        selections = timeStage(timings, "sample", lambda: [testPlan.sample(random.Random(versionSeed)) for versionSeed in versionSeeds])
+
+        #rendering into memory, so the write stage only measures the disk
+        def renderAll():
+            renderedVersions = []
+            for testNumber, chosenQuestionsBySet in enumerate(selections, 1):
+                testOut = io.StringIO()
+                answerOut = io.StringIO()
+                gatewaymaker.renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut)
+                renderedVersions.append((testNumber, testOut.getvalue(), answerOut.getvalue()))
+            return renderedVersions
+        renderedVersions = timeStage(timings, "render", renderAll)
+
+        def writeAll():
+            for testNumber, testTex, answerTex in renderedVersions:
+                testName, answerName = gatewaymaker.versionFileNames(testNumber)
+                (outputDir / testName).write_text(testTex)
+                (outputDir / answerName).write_text(answerTex)
+        timeStage(timings, "write", writeAll)
+        timings["bytes written"] = sum(len(testTex) + len(answerTex) for testNumber, testTex, answerTex in renderedVersions)
+    return timings
+
+def main(argv=None):
+    """
+    Runs the benchmark from the command line.
+
+    argv = command line arguments, defaults to sys.argv[1:]
+    """
+    parser = argparse.ArgumentParser(description="Time the stages of making tests on a synthetic question bank.")
+    parser.add_argument("--sets", type=int, default=4, help="number of question sets (default: 4)")
+    parser.add_argument("--files-per-set", type=int, default=5, help="number of question files in each set (default: 5)")
+    parser.add_argument("--questions-per-file", type=int, default=200, help="number of questions in each file (default: 200)")
+    parser.add_argument("--questions-per-set", type=int, default=5, help="number of questions chosen from each set (default: 5)")
+    parser.add_argument("--versions", type=int, default=500, help="number of tests to make (default: 500)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of times to run, keeping the fastest time for each stage (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic bank and the tests (default: 0)")
+    parser.add_argument("--output", default="benchmark_results.json", help="file to save the results to as JSON (default: benchmark_results.json)")
+    args = parser.parse_args(argv)
+    if args.questions_per_set > args.files_per_set * args.questions_per_file:
+        parser.error("--questions-per-set is more than there are questions in a set")
+
+    parameters = {
+        "sets":args.sets,
+        "files per set":args.files_per_set,
+        "questions per file":args.questions_per_file,
+        "questions per set":args.questions_per_set,
+        "versions":args.versions,
+        "seed":args.seed
+    }
+
+    #the headers are found relative to gatewaymaker, like when it runs as a script
+    outputPath = pathlib.Path(args.output).resolve()
+    os.chdir(pathlib.Path(gatewaymaker.__file__).resolve().parent)
+
+    #keep the best of each stage, since the slower runs are mostly noise from the rest of the machine
+    runs = [runBenchmark(parameters) for i in range(0, args.repeat)]
+    bestTimings = {stage:min(run[stage] for run in runs) for stage in runs[0]}
+
+    print("Stage                    Seconds")
+    for stage, seconds in bestTimings.items():
+        if stage != "bytes written":
+            print("  " + stage.ljust(22) + " " + format(seconds, ".4f"))
+    print("Bytes written: " + str(bestTimings["bytes written"]))
+
+    results = {
+        "parameters":parameters,
+        "repeat":args.repeat,
+        "python":platform.python_version(),
+        "platform":platform.platform(),
+        "timestamp":time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "best seconds":bestTimings,
+        "runs":runs
+    }
+    with open(outputPath, "w") as fout:
+        json.dump(results, fout, indent=4)
+    print("Saved results to " + str(outputPath))
+
+
+if __name__ == "__main__":
+    main()
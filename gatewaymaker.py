@@ -17,12 +17,45 @@
 # abongiov@kent.edu
 #################################################
 
+import argparse
 import json
 import pathlib
 import random
 import os
 import sys
-import copy
+import array
+import contextlib
+import re
+import time
+import hashlib
+import concurrent.futures
+import shlex
+import subprocess
+import io
+import zipfile
+import cProfile
+import threading
+import http.server
+import mmap
+import locale
+import bisect
+import itertools
+import collections.abc
+import queue
+import traceback
+
+#locking the output directory uses whichever of these the system has
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+#NumPy is only needed to choose a whole batch's questions at once
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 TITLE = "\
@@ -35,197 +68,3018 @@ TITLE = "\
 DIVIDER = "\
 --------------------------------------------------------------------------------"
 
-CONFIG_FILE_PATH = pathlib.Path("configuration/configuration.json")
-TEST_HEADER_FILE_PATH = pathlib.Path("configuration/test_header.tex")
-ANSWER_KEY_HEADER_FILE_PATH = pathlib.Path("configuration/test_header.tex")
-OUTPUT_DIR_PATH = pathlib.Path("tests")
-QUESTION_FILES_DIR_PATH = pathlib.Path("question_files")
+CONFIG_FILE_PATH = pathlib.Path("configuration/configuration.json")
+TEST_HEADER_FILE_PATH = pathlib.Path("configuration/test_header.tex")
+ANSWER_KEY_HEADER_FILE_PATH = pathlib.Path("configuration/test_header.tex")
+OUTPUT_DIR_PATH = pathlib.Path("tests")
+QUESTION_FILES_DIR_PATH = pathlib.Path("question_files")
+QUESTION_CACHE_FILE_PATH = pathlib.Path("configuration/question_cache.json")
+QUESTION_CACHE_VERSION = 2
+QUESTION_ID_LENGTH = 12
+SAMPLE_ATTEMPTS = 100
+VERSION_COUNTER_FILE_NAME = ".next_version"
+VERSION_LOCK_FILE_NAME = ".next_version.lock"
+VERSION_MANIFEST_FILE_NAME = "manifest.jsonl"
+COMPILE_CACHE_FILE_NAME = ".compile_cache.json"
+LATEX_COMMAND = "pdflatex -interaction=nonstopmode -halt-on-error -fmt={format} {file}"
+LATEX_FORMAT_COMMAND = "pdflatex -ini -interaction=nonstopmode -jobname={format} &pdflatex mylatexformat.ltx {file}"
+ANSWER_KEY_FILE_SUFFIX = "_answers.tex"
+OUTPUT_MODE_FILES = "files"
+OUTPUT_MODE_COMBINED = "combined"
+OUTPUT_MODE_ARCHIVE = "archive"
+AVOID_ALL_VERSIONS = "all"
+SERVICE_HOST = "127.0.0.1"
+WATCH_INTERVAL_SECONDS = 1
+PREVIEW_FILE_NAME = "preview"
+WRITER_QUEUE_SIZE = 64
+WRITER_BATCH_SIZE = 16
+WRITER_POLL_SECONDS = 0.5
+BATCH_SELECTION_CHUNK_SIZE = 1 << 22
+BATCH_REDRAW_ATTEMPTS = 3
+SIMULATION_CHUNK_SIZE = 1 << 16
+SIMULATION_LISTED_QUESTIONS = 5
+TEST_FILE_NAME_PATTERN = re.compile(r"test_([0-9]+)(_answers)?\.tex")
+
+TEX_ANSWERBOX_HEIGHT = "1.6cm"
+TEX_ANSWERBOX_WIDTH = "3cm"
+TEX_SPACING = "    "
+TEX_BEGIN_QUESTIONS = "\\begin{questions}"
+TEX_END_QUESTIONS = "\\end{questions}"
+TEX_ANSWER_BOX_EMPTY = "%\\\\[.3in] \\vspace*{-10ex} \n" + TEX_SPACING + "\\begin{flushright} \\fbox{\\rule[0cm]{0cm}{" + TEX_ANSWERBOX_HEIGHT + "} \\hspace{" + TEX_ANSWERBOX_WIDTH + "} } \\end{flushright} "
+TEX_ANSWER_BOX_FULL_START = "%\\\\[.3in] \\vspace*{-10ex} \n" + TEX_SPACING + "\\begin{flushright} \\fbox{\\rule[0cm]{0cm}{0cm} \\begin{minipage}[0pt][" + TEX_ANSWERBOX_HEIGHT + "][c]{" + TEX_ANSWERBOX_WIDTH + "} \\begin{center}"
+TEX_ANSWER_BOX_FULL_END = "\end{center} \\end{minipage}} \\end{flushright}"
+TEX_ITEM = "\\item "
+TEX_END_DOCUMENT = "\\end{document}"
+TEX_INSTRUCTION_START = "\\noindent \\bf{"
+TEX_INSTRUCTION_END = "}"
+TEX_NEWPAGE = "\\newpage"
+TEX_BEGIN_DOCUMENT = "\\begin{document}"
+TEX_END_QUESTIONS_BLOCK = TEX_END_QUESTIONS + "\n\n"
+TEX_PAGE_BREAK_LINE = TEX_SPACING + TEX_NEWPAGE + "\n"
+#macros for putting many versions in one document; they go after \begin{document} so they still work with a precompiled header format
+TEX_COMBINED_SETUP = """
+\\makeatletter
+\\newcounter{gatewaymakerPageOffset}
+\\newcounter{gatewaymakerVersionStart}
+\\gdef\\gatewaymakerIndex{}
+\\newcommand{\\gatewaymakerStartVersion}{%
+    \\clearpage
+    \\addtocounter{gatewaymakerPageOffset}{\\value{page}}%
+    \\addtocounter{gatewaymakerPageOffset}{-1}%
+    \\setcounter{page}{1}%
+    \\setcounter{gatewaymakerVersionStart}{\\value{gatewaymakerPageOffset}}%
+    \\stepcounter{gatewaymakerVersionStart}%
+    \\@ifundefined{c@questionCount}{}{\\setcounter{questionCount}{0}}%
+}
+%the rows already in the index are kept as they are, so their \\\\ isn't expanded again inside \\xdef
+\\newcommand{\\gatewaymakerEndVersion}[1]{%
+    \\clearpage
+    \\xdef\\gatewaymakerIndex{\\unexpanded\\expandafter{\\gatewaymakerIndex}#1 & \\arabic{gatewaymakerVersionStart}--\\number\\numexpr\\value{gatewaymakerPageOffset}+\\value{page}-1\\relax \\noexpand\\\\}%
+}
+\\makeatother
+"""
+TEX_COMBINED_INDEX = """\\pagestyle{empty}
+\\section*{Version index}
+\\begin{tabular}{ll}
+    Version & Pages \\\\ \\hline
+    \\gatewaymakerIndex
+\\end{tabular}
+"""
+
+#set by main() when running the menu; when imported as a library or run headless there is nobody to press enter
+INTERACTIVE = False
+
+
+def waitAndExit(exitCode):
+    """
+    Called to wait for the user to press enter, then exits with exitCode.
+    Good for users who double click to run the program, and may not see
+    any error messages if the program doesn't wait.  When not running
+    interactively, exits immediately.
+    """
+    if INTERACTIVE:
+        input("Press the 'Enter' key to exit...")
+    sys.exit(exitCode)
+
+def replaceFile(path, text):
+    """
+    Writes text to a temporary file next to path and then moves it over path,
+    so anything reading path, even another run, never sees it half written.
+    Raises IOError if it can't be written, leaving path as it was.
+    
+    path = pathlib.Path of the file to write
+    text = the new contents of the file
+    """
+    tempPath = path.with_name(path.name + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp")
+    try:
+        tempPath.write_text(text)
+        os.replace(tempPath, path)
+    except IOError:
+        with contextlib.suppress(IOError):
+            tempPath.unlink()
+        raise
+
+class CompileError(Exception):
+    """
+    Raised after making tests when some of their files couldn't be compiled.
+    The tests themselves were still made and recorded.
+    
+    failedFiles = names of the .tex files that failed to compile
+    testNumbers = the version numbers that were made
+    """
+    
+    def __init__(self, failedFiles, testNumbers):
+        super().__init__(str(len(failedFiles)) + " files failed to compile: " + ", ".join(failedFiles))
+        self.failedFiles = failedFiles
+        self.testNumbers = testNumbers
+
+class Instrumentation:
+    """
+    Opt-in timing and counters for making tests.  While an Instrumentation is
+    active (inside a with block), the stages of making tests record their wall
+    time, the time taken by each version, and counters such as files read and
+    bytes written.  When it isn't active, instrumentStage and instrumentCount do
+    nothing.  Tests made by worker processes aren't included.
+    """
+    
+    def __init__(self, profilePath=None):
+        """
+        profilePath = path to dump cProfile statistics to when the with block ends, or None to not profile
+        """
+        self.profilePath = profilePath
+        self.profiler = None
+        self.stageSeconds = {}
+        self.counters = {}
+        self.versionSeconds = {}
+        self.totalSeconds = 0.0
+        self.startTime = None
+    
+    def __enter__(self):
+        global activeInstrumentation
+        activeInstrumentation = self
+        self.startTime = time.perf_counter()
+        if self.profilePath is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self
+    
+    def __exit__(self, excType, excValue, traceback):
+        global activeInstrumentation
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(str(self.profilePath))
+        self.totalSeconds += time.perf_counter() - self.startTime
+        activeInstrumentation = None
+        return False
+    
+    @contextlib.contextmanager
+    def timeStage(self, stage):
+        """
+        Adds the wall time of a with block to a stage.
+        """
+        startTime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stageSeconds[stage] = self.stageSeconds.get(stage, 0.0) + time.perf_counter() - startTime
+    
+    def report(self):
+        """
+        Returns everything recorded as a dictionary that can be saved as JSON.
+        """
+        return {
+            "total seconds":self.totalSeconds,
+            "stage seconds":self.stageSeconds,
+            "counters":self.counters,
+            "version seconds":{str(testNumber):seconds for testNumber, seconds in self.versionSeconds.items()}
+        }
+    
+    def saveReport(self, reportPath):
+        """
+        Saves the report to a JSON file.
+        """
+        with open(reportPath, "w") as fout:
+            json.dump(self.report(), fout, indent=4)
+    
+    def printSummary(self):
+        """
+        Prints the time taken by each stage and the counters.
+        """
+        print("Total time: " + format(self.totalSeconds, ".3f") + "s")
+        for stage, seconds in self.stageSeconds.items():
+            print("\t" + stage + ": " + format(seconds, ".3f") + "s")
+        if self.versionSeconds:
+            versionSeconds = sorted(self.versionSeconds.values())
+            print("\tper version: " + format(versionSeconds[len(versionSeconds) // 2] * 1000, ".2f") + "ms median, " + format(versionSeconds[-1] * 1000, ".2f") + "ms slowest")
+        for counter, amount in self.counters.items():
+            print("\t" + counter + ": " + str(amount))
+
+#the Instrumentation inside whose with block we are, if any
+activeInstrumentation = None
+
+def instrumentStage(stage):
+    """
+    Returns a context manager that times its with block as part of a stage,
+    if instrumentation is active.
+    """
+    if activeInstrumentation is None:
+        return contextlib.nullcontext()
+    return activeInstrumentation.timeStage(stage)
+
+def instrumentCount(counter, amount=1):
+    """
+    Adds to a counter, if instrumentation is active.
+    """
+    if activeInstrumentation is not None:
+        activeInstrumentation.counters[counter] = activeInstrumentation.counters.get(counter, 0) + amount
+
+def loadConfig(configPath=CONFIG_FILE_PATH):
+    """
+    Reads and returns the JSON configuration, exiting with an error message if it can't be read.
+    
+    configPath = path to the configuration file
+    """
+    config = None
+    try:
+        with open(configPath, "r") as fin:
+            config = json.load(fin)
+    except IOError:
+        print("ERROR: The configuration file at " + str(configPath) + " could not be read.")
+        waitAndExit(1)
+    except json.decoder.JSONDecodeError as e:
+        print("ERROR: Configuration file has an error on line " + str(e.lineno) + ".  Check that the file is valid JSON.")
+        waitAndExit(1)
+    return config
+
+def parseQuestionTex(rawTex):
+    """
+    Splits the contents of a question file into questions and their answers.
+    Returns a tuple of three lists of equal length, (question tex, answer tex,
+    line numbers), with "" as the answer for questions that don't have one and
+    the line number of each question counting from 1.
+    
+    rawTex = the text of the question file
+    """
+    #remove whitespace and try to decide what lines are answers and what are questions
+    questionTex = []
+    answerTex = []
+    questionLines = []
+    texLines = rawTex.splitlines()
+    for i in range(0, len(texLines)):
+        #get the question, skipping empty lines or commented lines
+        cleanLine = texLines[i].strip()
+        if cleanLine == "" or cleanLine[0] == "%":
+            continue
+        questionTex.append(cleanLine)
+        questionLines.append(i + 1)
+        
+        #check if the next line is an answer, skipping empty lines or lines not starting with "%%"
+        if i+1 >= len(texLines):
+            answerTex.append("") #last line of the file, so no answer
+            continue
+        cleanLine = texLines[i+1].strip()
+        if cleanLine == "" or cleanLine[0:2] != "%%":
+            answerTex.append("")
+        else:
+            answerTex.append(cleanLine[2:])
+        #TODO - improve comment symbol removal?
+    return questionTex, answerTex, questionLines
+
+def questionId(questionText):
+    """
+    Returns the ID of a question: a short hash of its tex, so the same question
+    gets the same ID in whatever file, and at whatever line, it appears.
+    
+    questionText = the question's tex, as parseQuestionTex returns it
+    """
+    return hashlib.sha256(questionText.encode("utf-8")).hexdigest()[:QUESTION_ID_LENGTH]
+
+class QuestionBank:
+    """
+    Parsed question files, keyed by their resolved path.  Each distinct file
+    is read and parsed at most once, and the results are kept in an on-disk
+    cache keyed by path, size and modification time so that later runs only
+    re-parse files that changed.
+    
+    Every loaded question is also in questions, a dictionary from question ID
+    to a dictionary with its "question tex", "answer tex", and the "file path"
+    and "line" it was first found at.
+    """
+    
+    lazy = False
+    
+    def __init__(self, cachePath=QUESTION_CACHE_FILE_PATH):
+        """
+        cachePath = path of the on-disk cache, or None to not use one
+        """
+        self.cachePath = None if cachePath is None else pathlib.Path(cachePath)
+        self.files = {}
+        self.filePaths = {}
+        self.questions = {}
+        self.renderedFiles = {}
+        self.cacheChanged = False
+        
+        #a missing or broken cache just means everything gets parsed again
+        self.cache = {}
+        if self.cachePath is not None:
+            try:
+                with open(self.cachePath, "r") as fin:
+                    self.cache = json.load(fin)
+                if self.cache.get("version") != QUESTION_CACHE_VERSION:
+                    self.cache = {}
+            except (IOError, ValueError):
+                self.cache = {}
+        self.cache.setdefault("files", {})
+        self.cache["version"] = QUESTION_CACHE_VERSION
+    
+    @staticmethod
+    def key(filePath):
+        """
+        The key used for a question file, so different spellings of the same path share an entry.
+        """
+        return str(pathlib.Path(filePath).resolve())
+    
+    def load(self, filePaths):
+        """
+        Makes sure every file in filePaths is parsed, using the on-disk cache when
+        the file hasn't changed.  Exits with an error if a file can't be read.
+        
+        filePaths = iterable of question file paths
+        """
+        for filePath in filePaths:
+            key = QuestionBank.key(filePath)
+            if key in self.files:
+                continue
+            
+            try:
+                fileStat = os.stat(key)
+                instrumentCount("stat calls")
+                cached = self.cache["files"].get(key)
+                if cached is not None and cached["size"] == fileStat.st_size and cached["mtime"] == fileStat.st_mtime_ns:
+                    self.files[key] = cached
+                    self.filePaths[key] = filePath
+                    self.indexQuestions(filePath, cached)
+                    instrumentCount("question cache hits")
+                    instrumentCount("questions loaded", len(cached["question tex"]))
+                    continue
+                with open(key, "r") as fin:
+                    rawTex = fin.read()
+            except IOError:
+                print("ERROR: Problem reading question file at " + str(filePath) + ".")
+                waitAndExit(1)
+            
+            questionTex, answerTex, questionLines = parseQuestionTex(rawTex)
+            instrumentCount("files read")
+            instrumentCount("bytes parsed", fileStat.st_size) #bytes, not characters, like CompactQuestionBank
+            instrumentCount("questions loaded", len(questionTex))
+            entry = {
+                "size":fileStat.st_size,
+                "mtime":fileStat.st_mtime_ns,
+                "question tex":questionTex,
+                "answer tex":answerTex,
+                "question lines":questionLines,
+                "question ids":[questionId(questionText) for questionText in questionTex]
+            }
+            self.files[key] = entry
+            self.filePaths[key] = filePath
+            self.indexQuestions(filePath, entry)
+            self.cache["files"][key] = entry
+            self.cacheChanged = True
+    
+    def refresh(self):
+        """
+        Forgets every loaded file that has changed or disappeared since it was
+        loaded, so that the next load parses it again.  Returns the keys of the
+        files forgotten.
+        """
+        changedKeys = []
+        for key, entry in self.files.items():
+            try:
+                fileStat = os.stat(key)
+                instrumentCount("stat calls")
+                if entry["size"] != fileStat.st_size or entry["mtime"] != fileStat.st_mtime_ns:
+                    changedKeys.append(key)
+            except OSError:
+                changedKeys.append(key)
+        if changedKeys:
+            for key in changedKeys:
+                del self.files[key]
+                del self.filePaths[key]
+                self.renderedFiles.pop(key, None)
+            #a forgotten question may also be in a file that is still loaded, so index those again from scratch
+            self.questions = {}
+            for key, entry in self.files.items():
+                self.indexQuestions(self.filePaths[key], entry)
+        return changedKeys
+    
+    def indexQuestions(self, filePath, entry):
+        """
+        Adds a parsed file's questions to questions, keeping the first place each was found.
+        """
+        for questionText, answerText, questionLine, qid in zip(entry["question tex"], entry["answer tex"], entry["question lines"], entry["question ids"]):
+            if qid not in self.questions:
+                self.questions[qid] = {"question tex":questionText, "answer tex":answerText, "file path":str(filePath), "line":questionLine}
+    
+    def get(self, filePath):
+        """
+        Returns the parsed file as a dictionary with "question tex", "answer tex",
+        "question lines" and "question ids" lists.  The file must already have been loaded.
+        """
+        return self.files[QuestionBank.key(filePath)]
+    
+    def renderFragments(self, filePath):
+        """
+        Returns a loaded file's questions rendered as they appear on a test and an
+        answer key, as a tuple of two lists like renderQuestionFragments.  Each file
+        is only rendered once, however many sets and configurations use it.
+        """
+        key = QuestionBank.key(filePath)
+        if key not in self.renderedFiles:
+            questions = self.files[key]
+            self.renderedFiles[key] = renderQuestionFragments(questions["question tex"], questions["answer tex"])
+        return self.renderedFiles[key]
+    
+    def saveCache(self):
+        """
+        Writes the cache back to disk if anything was parsed.  Failing to write the cache isn't fatal.
+        """
+        if self.cachePath is None or not self.cacheChanged:
+            return
+        #a concurrent run never sees half a cache
+        try:
+            replaceFile(self.cachePath, json.dumps(self.cache))
+            self.cacheChanged = False
+        except IOError:
+            print("WARNING: could not write the question cache at " + str(self.cachePath))
+
+class CompactQuestionFile:
+    """
+    A question file that is memory-mapped rather than read, keeping only the
+    offset and length of each question and answer in arrays.  A question's text
+    is only decoded when it is asked for, so very large files cost little memory
+    beyond the pages actually used.
+    
+    It is parsed the same way as parseQuestionTex, except that only ASCII
+    whitespace is stripped and lines only end at \\n.  When pickled, only the
+    offsets are sent, and the file is mapped again on the other side.
+    """
+    
+    def __init__(self, filePath, encoding):
+        """
+        filePath = path of the question file
+        encoding = the encoding to decode the file's text with
+        """
+        self.filePath = str(filePath)
+        self.encoding = encoding
+        self.questionOffsets = array.array("q")
+        self.questionLengths = array.array("q")
+        self.answerOffsets = array.array("q")
+        self.answerLengths = array.array("q")
+        self.questionLines = array.array("i")
+        self.questionIds = []
+        self.mapFile()
+    
+    def mapFile(self):
+        """
+        Maps the file into memory.  Raises IOError if it can't be read.
+        """
+        with open(self.filePath, "rb") as fin:
+            #an empty file can't be mapped, but then there is nothing to read anyway
+            self.data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(fin.fileno()).st_size > 0 else b""
+    
+    def parse(self):
+        """
+        Finds every question and answer in the file, like parseQuestionTex.
+        """
+        data = self.data
+        lineStart = 0
+        lineNumber = 0
+        waitingForAnswer = False
+        while lineStart < len(data):
+            lineEnd = data.find(b"\n", lineStart)
+            if lineEnd == -1:
+                lineEnd = len(data)
+            line = data[lineStart:lineEnd]
+            cleanLine = line.strip()
+            cleanStart = lineStart + len(line) - len(line.lstrip())
+            lineNumber += 1
+            
+            #the line after a question is its answer if it starts with "%%"
+            if waitingForAnswer:
+                if cleanLine[0:2] == b"%%":
+                    self.answerOffsets.append(cleanStart + 2)
+                    self.answerLengths.append(len(cleanLine) - 2)
+                else:
+                    self.answerOffsets.append(0)
+                    self.answerLengths.append(0)
+                waitingForAnswer = False
+            
+            #get the question, skipping empty lines or commented lines
+            if cleanLine != b"" and cleanLine[0:1] != b"%":
+                self.questionOffsets.append(cleanStart)
+                self.questionLengths.append(len(cleanLine))
+                self.questionLines.append(lineNumber)
+                self.questionIds.append(questionId(cleanLine.decode(self.encoding)))
+                waitingForAnswer = True
+            lineStart = lineEnd + 1
+        if waitingForAnswer:
+            self.answerOffsets.append(0) #last line of the file, so no answer
+            self.answerLengths.append(0)
+    
+    def questionTex(self, questionIndex):
+        """
+        Returns the tex of a question in the file.
+        """
+        offset = self.questionOffsets[questionIndex]
+        return self.data[offset:offset + self.questionLengths[questionIndex]].decode(self.encoding)
+    
+    def answerTex(self, questionIndex):
+        """
+        Returns the tex of the answer to a question in the file, "" if it has none.
+        """
+        offset = self.answerOffsets[questionIndex]
+        return self.data[offset:offset + self.answerLengths[questionIndex]].decode(self.encoding)
+    
+    def testFragment(self, questionIndex):
+        """
+        Returns a question rendered as it appears on a test, like renderQuestionFragments.
+        """
+        return renderQuestionFragments([self.questionTex(questionIndex)], [""])[0][0]
+    
+    def answerKeyFragment(self, questionIndex):
+        """
+        Returns a question rendered as it appears on an answer key, like renderQuestionFragments.
+        """
+        return renderQuestionFragments([self.questionTex(questionIndex)], [self.answerTex(questionIndex)])[1][0]
+    
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["data"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mapFile()
+
+class LazySequence(collections.abc.Sequence):
+    """
+    A read-only sequence whose items are only made when they are asked for, by
+    calling makeItem with the item's index.
+    """
+    
+    def __init__(self, length, makeItem):
+        """
+        length = the number of items
+        makeItem = function from an index to the item, which must be picklable, such as a bound method
+        """
+        self.length = length
+        self.makeItem = makeItem
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, index):
+        if index < 0 or index >= self.length:
+            raise IndexError(index)
+        return self.makeItem(index)
+    
+    def __iter__(self):
+        return map(self.makeItem, range(0, self.length))
+
+class ChainedSequence(collections.abc.Sequence):
+    """
+    A read-only sequence of the items of several sequences one after another,
+    without copying them.
+    """
+    
+    def __init__(self, parts):
+        """
+        parts = the sequences to chain
+        """
+        self.parts = parts
+        self.starts = list(itertools.accumulate([0] + [len(part) for part in parts]))
+    
+    def __len__(self):
+        return self.starts[-1]
+    
+    def __getitem__(self, index):
+        if index < 0 or index >= self.starts[-1]:
+            raise IndexError(index)
+        partIndex = bisect.bisect_right(self.starts, index) - 1
+        return self.parts[partIndex][index - self.starts[partIndex]]
+    
+    def __iter__(self):
+        return itertools.chain.from_iterable(self.parts)
+
+class CompactQuestionIndex(collections.abc.Mapping):
+    """
+    QuestionBank.questions for a CompactQuestionBank: the same dictionaries,
+    but only made when one is looked up, so the text stays in the files.
+    """
+    
+    def __init__(self):
+        self.locations = {}
+    
+    def add(self, filePath, questionFile):
+        """
+        Adds a file's questions, keeping the first place each was found.
+        """
+        for questionIndex, qid in enumerate(questionFile.questionIds):
+            self.locations.setdefault(qid, (str(filePath), questionFile, questionIndex))
+    
+    def __getitem__(self, qid):
+        filePath, questionFile, questionIndex = self.locations[qid]
+        return {"question tex":questionFile.questionTex(questionIndex), "answer tex":questionFile.answerTex(questionIndex), "file path":filePath, "line":questionFile.questionLines[questionIndex]}
+    
+    def __iter__(self):
+        return iter(self.locations)
+    
+    def __len__(self):
+        return len(self.locations)
+
+class CompactQuestionBank:
+    """
+    A QuestionBank for question files too big to comfortably hold in memory.
+    Each file is memory-mapped, and only the offsets of its questions and
+    answers are kept, so memory use grows with the questions used on the tests
+    rather than with the whole bank.  There is no on-disk cache, since finding
+    the offsets is about as quick as reading them back would be.
+    """
+    
+    lazy = True
+    
+    def __init__(self):
+        self.files = {}
+        self.questions = CompactQuestionIndex()
+        self.encoding = locale.getpreferredencoding(False) #the same as open() uses for QuestionBank
+    
+    def load(self, filePaths):
+        """
+        Makes sure every file in filePaths is mapped and parsed.  Exits with an
+        error if a file can't be read.
+        
+        filePaths = iterable of question file paths
+        """
+        for filePath in filePaths:
+            key = QuestionBank.key(filePath)
+            if key in self.files:
+                continue
+            try:
+                questionFile = CompactQuestionFile(key, self.encoding)
+                questionFile.parse()
+            except (IOError, UnicodeDecodeError):
+                print("ERROR: Problem reading question file at " + str(filePath) + ".")
+                waitAndExit(1)
+            instrumentCount("files mapped")
+            instrumentCount("bytes parsed", len(questionFile.data))
+            instrumentCount("questions loaded", len(questionFile.questionIds))
+            self.files[key] = {
+                "question tex":LazySequence(len(questionFile.questionIds), questionFile.questionTex),
+                "answer tex":LazySequence(len(questionFile.questionIds), questionFile.answerTex),
+                "question lines":questionFile.questionLines,
+                "question ids":questionFile.questionIds,
+                "file":questionFile
+            }
+            self.questions.add(filePath, questionFile)
+    
+    def get(self, filePath):
+        """
+        Returns the parsed file like QuestionBank.get, except the tex lists only read the file when indexed.
+        """
+        return self.files[QuestionBank.key(filePath)]
+    
+    def renderFragments(self, filePath):
+        """
+        Returns the file's questions rendered like QuestionBank.renderFragments, but only rendered when indexed.
+        """
+        questionFile = self.get(filePath)["file"]
+        return LazySequence(len(questionFile.questionIds), questionFile.testFragment), LazySequence(len(questionFile.questionIds), questionFile.answerKeyFragment)
+    
+    def saveCache(self):
+        """
+        Does nothing, there is no cache.
+        """
+        pass
+
+def updateJsonHash(hasher, value):
+    """
+    Adds the JSON for value to a hash a piece at a time, giving the same hash
+    as hashing json.dumps(value) but without making the whole string at once.
+    
+    hasher = the hashlib hash to update
+    value = a string, number or sequence of them, such as the ChainedSequences of a TestPlan
+    """
+    if isinstance(value, (str, int, float)) or value is None:
+        hasher.update(json.dumps(value).encode("utf-8"))
+        return
+    #long lists of strings are hashed a batch at a time, since hashing each string alone is slow
+    hasher.update(b"[")
+    batch = []
+    for index, item in enumerate(value):
+        if index > 0:
+            batch.append(", ")
+        if isinstance(item, (str, int, float)) or item is None:
+            batch.append(json.dumps(item))
+            if len(batch) < 2048:
+                continue
+        hasher.update("".join(batch).encode("utf-8"))
+        batch = []
+        if not (isinstance(item, (str, int, float)) or item is None):
+            updateJsonHash(hasher, item)
+    hasher.update("".join(batch).encode("utf-8"))
+    hasher.update(b"]")
+
+def loadTestPlan(config, cachePath=QUESTION_CACHE_FILE_PATH, questionBank=None, testHeaderPath=TEST_HEADER_FILE_PATH, answerHeaderPath=ANSWER_KEY_HEADER_FILE_PATH):
+    """
+    Reads the headers and question files for a configuration, checks that there
+    are enough questions, and returns the TestPlan.  Exits with an error message
+    if anything is wrong.
+    
+    config = config file for the program
+    cachePath = path of the parsed question file cache, or None to always parse the files
+    questionBank = QuestionBank or CompactQuestionBank to load the question files into, so files it already
+                   has aren't read again; None for a new QuestionBank using cachePath
+    testHeaderPath = path to the header for tests
+    answerHeaderPath = path to the header for answer keys
+    """
+    with instrumentStage("read headers"):
+        testHeader, answerHeader = readHeaders(testHeaderPath, answerHeaderPath)
+    
+    #read in the question files - each distinct file is only parsed once, even if several sets use it
+    with instrumentStage("parse"):
+        if questionBank is None:
+            questionBank = QuestionBank(cachePath)
+        questionBank.load(questionFile["file path"] for questionSet in config["question sets"] for questionFile in questionSet["question files"])
+        questionBank.saveCache()
+    
+    #verify that there is enough questions to make the test, error and exit if not
+    with instrumentStage("validate"):
+        insufficientSets, overcommittedSets = validateQuestionSets(config, questionBank)
+    if insufficientSets:
+        printInsufficientQuestionSets(config, insufficientSets[:1])
+        waitAndExit(1)
+    if overcommittedSets:
+        printOvercommittedQuestionSets(overcommittedSets)
+        waitAndExit(1)
+    
+    #everything that doesn't change between tests is worked out once here
+    with instrumentStage("plan"):
+        return TestPlan(config, questionBank, testHeader, answerHeader)
+
+def readHeaders(testHeaderPath=TEST_HEADER_FILE_PATH, answerHeaderPath=ANSWER_KEY_HEADER_FILE_PATH):
+    """
+    Reads the LaTeX headers, returning (test header, answer key header).  Exits
+    with an error message if they can't be read.
+    
+    testHeaderPath = path to the header for tests
+    answerHeaderPath = path to the header for answer keys
+    """
+    #read in the latex headers
+    testHeader = ""
+    try:
+        with open(testHeaderPath, "r") as fin:
+            testHeader = fin.read()
+    except IOError:
+        print("ERROR: Couldn't read the latex header file at " + str(testHeaderPath))
+        waitAndExit(1)
+        
+    answerHeader = ""
+    try:
+        with open(answerHeaderPath, "r") as fin:
+            answerHeader = fin.read()
+    except IOError:
+        print("ERROR: Couldn't read the latex header file at " + str(answerHeaderPath))
+        waitAndExit(1)
+    return testHeader, answerHeader
+
+def validateQuestionSets(config, questionBank):
+    """
+    Checks that there are enough questions to make a test, first in each set and
+    then between the sets that share questions.  Returns (what
+    findInsufficientQuestionSets found, what findOvercommittedQuestionSets found),
+    both empty if a test can be made.
+    
+    config = config file for the program
+    questionBank = QuestionBank with the sets' question files loaded
+    """
+    insufficientSets = findInsufficientQuestionSets(config, questionBank)
+    if insufficientSets:
+        return insufficientSets, []
+    return insufficientSets, findOvercommittedQuestionSets(config, questionBank)
+
+def findInsufficientQuestionSets(config, questionBank, setIndices=None):
+    """
+    Returns the indices of the question sets that don't have enough different
+    questions in their files for the number of questions to choose from them.
+    A question that is in several of a set's files only counts once.
+    
+    config = config file for the program
+    questionBank = QuestionBank with the sets' question files loaded
+    setIndices = the indices of the sets to check, or None to check every set
+    """
+    if setIndices is None:
+        setIndices = range(0, len(config["question sets"]))
+    insufficientSets = []
+    for setIndex in setIndices:
+        questionSet = config["question sets"][setIndex]
+        if questionSet["number of questions"] > len({qid for qf in questionSet["question files"] for qid in questionBank.get(qf["file path"])["question ids"]}):
+            insufficientSets.append(setIndex)
+    return insufficientSets
+
+def findOvercommittedQuestionSets(config, questionBank):
+    """
+    Finds groups of question sets that share questions and, although each has
+    enough questions by itself, don't have enough different questions between
+    them to all be on one test without repeating a question.  Returns a list of
+    (indices of the sets in the group, questions they need, different questions
+    they have).  Only meaningful once findInsufficientQuestionSets finds nothing.
+    
+    config = config file for the program
+    questionBank = QuestionBank with the sets' question files loaded
+    """
+    #questions in exactly the same sets are interchangeable, so only how many there are matters
+    setsOfQuestion = {}
+    for setIndex, questionSet in enumerate(config["question sets"]):
+        for questionFile in questionSet["question files"]:
+            for qid in questionBank.get(questionFile["file path"])["question ids"]:
+                setsOfQuestion[qid] = setsOfQuestion.get(qid, 0) | (1 << setIndex)
+    handedOut, overcommitted = assignQuestionGroups(collections.Counter(setsOfQuestion.values()), [questionSet["number of questions"] for questionSet in config["question sets"]])
+    return overcommitted
+
+def assignQuestionGroups(groupSizes, neededBySet, rng=None):
+    """
+    Works out how many questions each set can take from each group of questions
+    that are in the same sets, so that every set gets all it needs and no
+    question goes to two sets.  Questions are handed out to the sets one at a
+    time, moving earlier ones between sets to make room when needed, which is a
+    small max flow.  When a set can't get another question, the sets it could
+    have taken one from are overcommitted.
+    
+    Returns (dictionary from (set index, group) to how many of the group's
+    questions the set takes, list of overcommitted groups of sets as described
+    in findOvercommittedQuestionSets).
+    
+    groupSizes = dictionary from a group, a bit mask of the sets its questions are in, to how many questions it has
+    neededBySet = how many questions each set needs
+    rng = random.Random to shuffle the order groups are tried in, so the assignment varies; None for a fixed order
+    """
+    groupsOfSet = [[setMask for setMask in groupSizes if setMask >> setIndex & 1] for setIndex in range(0, len(neededBySet))]
+    if rng is not None:
+        for setGroups in groupsOfSet:
+            rng.shuffle(setGroups)
+    
+    handedOut = {}
+    groupRemaining = dict(groupSizes)
+    overcommitted = []
+    settled = set()
+    for setIndex, needed in enumerate(neededBySet):
+        for questionNumber in range(0, needed):
+            if setIndex in settled:
+                break
+            
+            #breadth first search for a group with a question left, taking questions back from other sets on the way
+            cameFrom = {setIndex:None}
+            frontier = [setIndex]
+            foundGroup = None
+            while frontier and foundGroup is None:
+                nextFrontier = []
+                for frontierSet in frontier:
+                    for setMask in groupsOfSet[frontierSet]:
+                        if groupRemaining[setMask] > 0:
+                            foundGroup = (frontierSet, setMask)
+                            break
+                        for otherSet, otherMask in handedOut:
+                            if otherMask == setMask and otherSet not in cameFrom and handedOut[(otherSet, otherMask)] > 0:
+                                cameFrom[otherSet] = (frontierSet, setMask)
+                                nextFrontier.append(otherSet)
+                    if foundGroup is not None:
+                        break
+                frontier = nextFrontier
+            
+            if foundGroup is None:
+                groupSets = sorted(cameFrom)
+                groupMask = sum(1 << groupSet for groupSet in groupSets)
+                available = sum(size for setMask, size in groupSizes.items() if setMask & groupMask)
+                overcommitted.append((groupSets, sum(neededBySet[groupSet] for groupSet in groupSets), available))
+                settled.update(groupSets)
+                break
+            
+            #the last set on the path takes the free question, and each set before it takes the place of the one after
+            pathSet, setMask = foundGroup
+            groupRemaining[setMask] -= 1
+            while True:
+                handedOut[(pathSet, setMask)] = handedOut.get((pathSet, setMask), 0) + 1
+                if cameFrom[pathSet] is None:
+                    break
+                previousSet, previousMask = cameFrom[pathSet]
+                handedOut[(pathSet, previousMask)] -= 1
+                pathSet, setMask = previousSet, previousMask
+    return handedOut, overcommitted
+
+def runCatalog(catalogPath, cachePath=QUESTION_CACHE_FILE_PATH, seed=None, workers=1, compileSettings=None, outputMode=OUTPUT_MODE_FILES, avoidVersions=None, pipelined=False, batchSelection=False, compact=False):
+    """
+    Makes tests for every configuration in a catalog in one go.  The catalog
+    is a JSON file with a list of "configurations", each a dictionary with:
+        "configuration" = path to the configuration file
+        "number of tests" = how many tests to make from it
+        "output dir" = directory to write its tests into
+        "test header", "answer key header" = paths to its headers, if not the usual ones
+        "seed" = seed for its tests, if not derived from seed
+    Paths are relative to the catalog's directory.  Every configuration is
+    loaded and checked before any tests are made, and each question file is
+    read and rendered only once, however many configurations use it.  Exits
+    with an error message if anything is wrong.  If compiling was asked for,
+    every configuration is still made when some files fail to compile, and then
+    CompileError is raised for all of them.
+    
+    catalogPath = path to the catalog file
+    cachePath = path of the parsed question file cache, or None to always parse the files
+    seed = seed to derive each configuration's seed from when it doesn't have one, or None to seed from the system
+    workers, compileSettings, outputMode, avoidVersions, pipelined, batchSelection = as for createTests, for every configuration
+    compact = True to share a CompactQuestionBank between the configurations instead of a QuestionBank
+    """
+    catalogPath = pathlib.Path(catalogPath)
+    catalog = loadConfig(catalogPath)
+    entries = catalog.get("configurations") if isinstance(catalog, dict) else None
+    if not isinstance(entries, list):
+        print("ERROR: The catalog at " + str(catalogPath) + " needs a list of \"configurations\".")
+        waitAndExit(1)
+    
+    #load and check everything up front, so a mistake in the last configuration doesn't leave the catalog half made
+    questionBank = CompactQuestionBank() if compact else QuestionBank(cachePath)
+    plannedEntries = []
+    for entryIndex, entry in enumerate(entries):
+        if not isinstance(entry, dict) or "configuration" not in entry or "output dir" not in entry or not isinstance(entry.get("number of tests"), int) or entry["number of tests"] < 1:
+            print("ERROR: Entry " + str(entryIndex + 1) + " of the catalog needs a \"configuration\", an \"output dir\" and a \"number of tests\" of at least 1.")
+            waitAndExit(1)
+        configPath = catalogPath.parent / entry["configuration"]
+        config = loadConfig(configPath)
+        testHeaderPath = catalogPath.parent / entry["test header"] if "test header" in entry else TEST_HEADER_FILE_PATH
+        answerHeaderPath = catalogPath.parent / entry["answer key header"] if "answer key header" in entry else ANSWER_KEY_HEADER_FILE_PATH
+        testPlan = loadTestPlan(config, questionBank=questionBank, testHeaderPath=testHeaderPath, answerHeaderPath=answerHeaderPath)
+        entrySeed = entry.get("seed", None if seed is None else deriveVersionSeed(seed, entryIndex))
+        plannedEntries.append((configPath, config, testPlan, entry["number of tests"], catalogPath.parent / entry["output dir"], entrySeed))
+    print("Loaded " + str(len(plannedEntries)) + " configurations using " + str(len(questionBank.files)) + " question files")
+    
+    failedFiles = []
+    testNumbers = []
+    for configPath, config, testPlan, numberOfTests, outputDir, entrySeed in plannedEntries:
+        print(DIVIDER)
+        print("Making " + str(numberOfTests) + " tests from " + str(configPath) + " in " + str(outputDir))
+        try:
+            testNumbers.extend(createTests(config, numberOfTests, outputDir, entrySeed, workers=workers, compileSettings=compileSettings, outputMode=outputMode, avoidVersions=avoidVersions, testPlan=testPlan, pipelined=pipelined, batchSelection=batchSelection))
+        except CompileError as e:
+            failedFiles.extend(str(outputDir / texName) for texName in e.failedFiles)
+            testNumbers.extend(e.testNumbers)
+    if failedFiles:
+        raise CompileError(failedFiles, testNumbers)
+
+def printInsufficientQuestionSets(config, insufficientSets):
+    """
+    Prints an error for each of the question sets found by findInsufficientQuestionSets.
+    """
+    for setIndex in insufficientSets:
+        questionSet = config["question sets"][setIndex]
+        print("ERROR: Insufficient number of questions in")
+        for questionFile in questionSet["question files"]:
+            print("\t" + questionFile["file path"])
+        print("Expected at least " + str(questionSet["number of questions"]) + " different questions total.")
+
+def printOvercommittedQuestionSets(overcommittedSets):
+    """
+    Prints an error for each of the groups of question sets found by findOvercommittedQuestionSets.
+    """
+    for setIndices, needed, available in overcommittedSets:
+        setNames = [str(setIndex + 1) for setIndex in setIndices]
+        print("ERROR: Question sets " + ", ".join(setNames[:-1]) + " and " + setNames[-1] + " share questions, and need " + str(needed) + " different questions between them, but only have " + str(available) + ".")
+        print("A question is never put on a test twice, so add more questions or choose fewer from these sets.")
+
+def deriveVersionSeed(batchSeed, index):
+    """
+    Returns the seed for the index-th test of a batch.  Every test gets its own
+    seed so that a test only depends on the batch seed and its place in the
+    batch, not on which tests were made before it or by which process.
+    
+    batchSeed = the seed for the whole batch
+    index = the position of the test in the batch, starting at 0
+    """
+    digest = hashlib.sha256((str(batchSeed) + ":" + str(index)).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def createTests(config, numberOfTests, outputDir=OUTPUT_DIR_PATH, seed=None, cachePath=QUESTION_CACHE_FILE_PATH, workers=1, writeFiles=True, compileSettings=None, outputMode=OUTPUT_MODE_FILES, avoidVersions=None, testPlan=None, pipelined=False, batchSelection=False):
+    """
+    Create the given number of tests and answer keys based on the current configuration.
+    Returns the list of version numbers made.  Raises CompileError if compiling
+    was asked for and any of the files failed to compile.  When pipelined, raises
+    IOError if the tests can't be written, after recording in the manifest the
+    ones that were.
+    
+    config = config file for the program
+    numberOfTests = number of tests to create
+    outputDir = directory to write the tests and answer keys into
+    seed = seed for the random number generator, so a batch can be reproduced; None to seed from the system
+    cachePath = path of the parsed question file cache, or None to always parse the files
+    workers = number of processes to make the tests with; the tests made don't depend on this
+    writeFiles = False to only record the tests in the manifest, so they can be made later with regenerateVersion
+    compileSettings = settings for compileTests to compile the tests to PDF afterwards, or None to leave them as .tex
+    outputMode = OUTPUT_MODE_FILES to write each test and answer key to its own file, or
+                 OUTPUT_MODE_COMBINED to write all of them into one test document and one answer key document, or
+                 OUTPUT_MODE_ARCHIVE to write all of the files, and the batch's manifest, into one zip archive
+    avoidVersions = None to choose each test's questions independently, otherwise choose questions that overlap as
+                    little as possible with the other tests in the batch and with these earlier versions from the
+                    manifest; a list of version numbers, or AVOID_ALL_VERSIONS for every version in the manifest
+    testPlan = the TestPlan for config if it has already been loaded, or None to load it
+    pipelined = True to write the tests from a background thread while the next ones are rendered, when there is one worker
+    batchSelection = True to choose every test's questions at once with selectAllVersions, which needs NumPy;
+                     ignored when avoidVersions is given
+    """
+    outputDir = pathlib.Path(outputDir)
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    
+    if testPlan is None:
+        testPlan = loadTestPlan(config, cachePath)
+
+    #make the directory for the tests if it doesn't already exist
+    try:
+        outputDir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        print("ERROR: problem with the output directory at: " + str(outputDir))
+        print("Check permissions or that there isn't a file with the same name")
+        waitAndExit(1)
+    
+    #reserve all of the version numbers up front, so concurrent runs can't collide
+    try:
+        with instrumentStage("allocate versions"):
+            firstTestNumber = reserveVersionNumbers(outputDir, numberOfTests)
+    except IOError:
+        print("ERROR: could not update the version counter in " + str(outputDir) + ", please check write permissions.")
+        waitAndExit(1)
+    versionSeeds = [deriveVersionSeed(seed, i) for i in range(0, numberOfTests)]
+    testNumbers = range(firstTestNumber, firstTestNumber + numberOfTests)
+    
+    #spreading questions out depends on what the earlier tests chose, so all the choosing happens up front
+    if avoidVersions is None and batchSelection:
+        with instrumentStage("sample"):
+            selections = selectAllVersions(testPlan, numberOfTests, seed)
+    elif avoidVersions is None:
+        selections = [None] * numberOfTests
+    else:
+        usageTracker = UsageTracker(testPlan)
+        for chosenQuestionsBySet in loadSelectionHistory(testPlan, outputDir, avoidVersions):
+            usageTracker.record(chosenQuestionsBySet)
+        with instrumentStage("sample"):
+            selections = [usageTracker.sample(random.Random(versionSeed)) for versionSeed in versionSeeds]
+    versions = list(zip(testNumbers, versionSeeds, selections))
+    
+    #just note down how to make the tests
+    if not writeFiles:
+        try:
+            with instrumentStage("manifest"):
+                appendManifest(outputDir, testPlan, versions)
+        except IOError:
+            print("ERROR: could not write the manifest in " + str(outputDir) + ", please check write permissions.")
+            waitAndExit(1)
+        for testNumber in testNumbers:
+            print("Recorded version " + str(testNumber) + " in the manifest")
+        return list(testNumbers)
+    
+    #one document for the whole batch
+    if outputMode == OUTPUT_MODE_COMBINED:
+        try:
+            with instrumentStage("render and write"):
+                combinedNames = writeCombinedTests(testPlan, outputDir, versions)
+            with instrumentStage("manifest"):
+                appendManifest(outputDir, testPlan, versions)
+        except ValueError:
+            print("ERROR: the header has no " + TEX_BEGIN_DOCUMENT + ", which is needed to put the tests in one document.")
+            waitAndExit(1)
+        except IOError:
+            print("ERROR: could not write out the test file, please check write permissions.")
+            waitAndExit(1)
+        print("Created '" + combinedNames[0] + "' and '" + combinedNames[1] + "' with versions " + str(testNumbers[0]) + " to " + str(testNumbers[-1]))
+        if compileSettings is not None:
+            failedFiles = compileTests(testPlan, outputDir, combinedNames, compileSettings)
+            if failedFiles:
+                raise CompileError(failedFiles, list(testNumbers))
+        return list(testNumbers)
+    
+    #one archive for the whole batch
+    if outputMode == OUTPUT_MODE_ARCHIVE:
+        try:
+            with instrumentStage("render and write"):
+                archiveName = writeArchivedTests(testPlan, outputDir, versions)
+            with instrumentStage("manifest"):
+                appendManifest(outputDir, testPlan, versions)
+        except IOError:
+            print("ERROR: could not write out the test archive, please check write permissions.")
+            waitAndExit(1)
+        print("Created '" + archiveName + "' with versions " + str(testNumbers[0]) + " to " + str(testNumbers[-1]))
+        if compileSettings is not None:
+            print("WARNING: tests in an archive aren't compiled, extract them first.")
+        return list(testNumbers)
+    
+    if pipelined and not (workers > 1 and numberOfTests > 1):
+        #the versions that reached the disk are recorded before a write error goes back to the caller
+        writtenVersions, writeError = writeVersionsInBackground(testPlan, outputDir, versions)
+        with instrumentStage("manifest"):
+            appendManifest(outputDir, testPlan, writtenVersions)
+        if writeError is not None:
+            raise writeError
+    else:
+        try:
+            if workers > 1 and numberOfTests > 1:
+                #each worker gets its own copy of the plan once, rather than once per test
+                with instrumentStage("workers"), concurrent.futures.ProcessPoolExecutor(workers, initializer=initVersionWorker, initargs=(testPlan, outputDir)) as pool:
+                    createdVersions = pool.map(makeVersionInWorker, versionSeeds, testNumbers, selections, chunksize=max(1, numberOfTests // (workers * 4)))
+                    writtenVersions = reportCreatedVersions(testPlan, outputDir, versions, createdVersions)
+                instrumentCount("versions written", len(writtenVersions))
+            else:
+                createdVersions = (makeVersion(testPlan, outputDir, versionSeed, testNumber, chosenQuestionsBySet=chosenQuestionsBySet) for testNumber, versionSeed, chosenQuestionsBySet in versions)
+                writtenVersions = reportCreatedVersions(testPlan, outputDir, versions, createdVersions)
+            with instrumentStage("manifest"):
+                appendManifest(outputDir, testPlan, writtenVersions)
+        except IOError as e:
+            print("ERROR: could not write out the test file, please check write permissions.")
+            print("\t" + str(e))
+            waitAndExit(1)
+    
+    writtenNumbers = [testNumber for testNumber, versionSeed, chosenQuestionsBySet in writtenVersions]
+    if compileSettings is not None:
+        failedFiles = compileTests(testPlan, outputDir, [texName for testNumber in writtenNumbers for texName in versionFileNames(testNumber)], compileSettings)
+        if failedFiles:
+            raise CompileError(failedFiles, writtenNumbers)
+    return writtenNumbers
+
+def selectAllVersions(testPlan, numberOfTests, seed):
+    """
+    Chooses the questions for a whole batch of tests at once with NumPy, rather
+    than one test at a time.  Each set's choices are an N by k matrix of question
+    indices, one row per test, made in a few array operations.  The choices are
+    as random as TestPlan.sample's, and the same seed always gives the same
+    batch, but they aren't the ones TestPlan.sample would make from each test's
+    own seed, so they have to be recorded in the manifest.  Sets that share
+    questions are handled the same way as TestPlan.sample handles them.
+    
+    Returns a list of each test's chosen questions, like TestPlan.sample returns.
+    
+    testPlan = the TestPlan to choose questions from
+    numberOfTests = the number of tests in the batch
+    seed = seed for NumPy's random number generator
+    """
+    matrices = chooseSelectionMatrices(testPlan, numberOfTests, numpy.random.default_rng(seed), questionNumberArrays(testPlan))
+    
+    #the renderer works through plain lists fastest
+    return [list(chosenQuestionsBySet) for chosenQuestionsBySet in zip(*[matrix.tolist() for matrix in matrices])]
+
+def questionNumberArrays(testPlan):
+    """
+    Numbers every different question in a TestPlan, so the same question gets
+    the same number wherever it is.  Returns a list with each set's array of the
+    number of each of its questions.
+    """
+    questionNumbers = {}
+    return [numpy.array([questionNumbers.setdefault(qid, len(questionNumbers)) for qid in plannedSet["question ids"]], dtype=numpy.int64) for plannedSet in testPlan.sets]
+
+def chooseSelectionMatrices(testPlan, numberOfTests, rng, numberArrays):
+    """
+    Chooses the questions for many tests at once, as described in selectAllVersions.
+    Returns a list with each set's matrix of chosen question indices.
+    
+    testPlan = the TestPlan to choose questions from
+    numberOfTests = the number of tests
+    rng = the numpy.random.Generator to choose with
+    numberArrays = the TestPlan's questionNumberArrays
+    """
+    matrices = [numpy.empty((numberOfTests, plannedSet["number of questions"]), dtype=numpy.int32) for plannedSet in testPlan.sets]
+    
+    #like TestPlan.sample, a test where an earlier set took too many of a later set's questions starts again from the first set
+    restartRows = numpy.arange(numberOfTests)
+    for attempt in range(0, SAMPLE_ATTEMPTS):
+        attemptMatrices, completeRows = chooseSelectionAttempt(testPlan, len(restartRows), rng, numberArrays)
+        for matrix, attemptMatrix in zip(matrices, attemptMatrices):
+            matrix[restartRows] = attemptMatrix
+        restartRows = restartRows[~completeRows]
+        if len(restartRows) == 0:
+            break
+    else:
+        #the sets only just have enough between them, so the rest are chosen from a feasible assignment like TestPlan.sample does
+        sampleRng = random.Random(int(rng.integers(0, 1 << 63)))
+        for row in restartRows.tolist():
+            chosenQuestionsBySet = [matrix[row].tolist() for matrix in matrices]
+            testPlan.sampleFeasible(chosenQuestionsBySet, sampleRng)
+            for matrix, plannedSet, chosenQuestions in zip(matrices, testPlan.sets, chosenQuestionsBySet):
+                chosenQuestions.extend(TestPlan.fillRepeats(plannedSet, chosenQuestions))
+                matrix[row] = sorted(chosenQuestions, key=plannedSet["file of question"].__getitem__)
+    return matrices
+
+def chooseSelectionAttempt(testPlan, numberOfTests, rng, numberArrays):
+    """
+    Makes one attempt at choosing the questions for many tests at once.  Each
+    set sharing questions chooses from the questions the earlier sets left it:
+    rows that took an earlier set's question are drawn again a few times, and
+    any still left choose from exactly the questions that are free.  Returns
+    (each set's matrix of chosen question indices, boolean array of the rows
+    where every set got its questions).
+    
+    testPlan = the TestPlan to choose questions from
+    numberOfTests = the number of tests
+    rng = the numpy.random.Generator to choose with
+    numberArrays = the TestPlan's questionNumberArrays
+    """
+    matrices = []
+    sharedNumbers = []
+    completeRows = numpy.ones(numberOfTests, dtype=bool)
+    for plannedSet, numberArray in zip(testPlan.sets, numberArrays):
+        matrix = chooseSetMatrix(plannedSet, numberOfTests, rng)
+        matrices.append(matrix)
+        if not plannedSet["shares questions"]:
+            continue
+        
+        #drawing again is cheapest while only a few rows took an earlier set's question
+        repeatRows = numpy.arange(numberOfTests) if sharedNumbers else numpy.empty(0, dtype=numpy.intp)
+        for attempt in range(0, BATCH_REDRAW_ATTEMPTS + 1):
+            if len(repeatRows) == 0:
+                break
+            chosenNumbers = numpy.sort(numpy.concatenate([numbers[repeatRows] for numbers in sharedNumbers] + [numberArray[matrix[repeatRows]]], axis=1), axis=1)
+            repeatRows = repeatRows[(chosenNumbers[:, 1:] == chosenNumbers[:, :-1]).any(axis=1)]
+            if len(repeatRows) > 0 and attempt < BATCH_REDRAW_ATTEMPTS:
+                matrix[repeatRows] = chooseSetMatrix(plannedSet, len(repeatRows), rng)
+        if len(repeatRows) > 0:
+            freeMatrix, filledRows = chooseFreeSetMatrix(plannedSet, numberArray, numpy.concatenate([numbers[repeatRows] for numbers in sharedNumbers], axis=1), rng)
+            matrix[repeatRows[filledRows]] = freeMatrix[filledRows]
+            completeRows[repeatRows[~filledRows]] = False
+        sharedNumbers.append(numberArray[matrix])
+    return matrices, completeRows
+
+def chooseFreeSetMatrix(plannedSet, numberArray, usedNumbers, rng):
+    """
+    Chooses a set's questions for many tests at once, like chooseSetMatrix, but
+    only from the questions each test doesn't already have.  Returns (the matrix,
+    boolean array of the rows that had enough questions free; the others are
+    left unfilled).
+    
+    plannedSet = the set to choose from
+    numberArray = the set's array from questionNumberArrays
+    usedNumbers = matrix with a row of the question numbers each test already has
+    rng = the numpy.random.Generator to choose with
+    """
+    candidates = numpy.frombuffer(plannedSet["distinct questions"], dtype=numpy.int32)
+    fileOfQuestion = numpy.frombuffer(plannedSet["file of question"], dtype=numpy.int32)
+    needed = plannedSet["number of questions"]
+    
+    #where each used question is among the set's candidates, or -1 if it isn't one of them
+    positionOfNumber = numpy.full(max(numberArray.max(), usedNumbers.max()) + 1, -1, dtype=numpy.int64)
+    positionOfNumber[numberArray[candidates]] = numpy.arange(len(candidates))
+    usedPositions = positionOfNumber[usedNumbers]
+    filledRows = len(candidates) - (usedPositions >= 0).sum(axis=1) >= needed
+    
+    #used questions get a key bigger than any random one, so they are never among the smallest
+    matrix = numpy.empty((len(usedNumbers), needed), dtype=numpy.int32)
+    rows = numpy.flatnonzero(filledRows)
+    rowsPerChunk = max(1, BATCH_SELECTION_CHUNK_SIZE // max(1, len(candidates)))
+    for firstRow in range(0, len(rows), rowsPerChunk):
+        chunkRows = rows[firstRow:firstRow + rowsPerChunk]
+        chunkPositions = usedPositions[chunkRows]
+        keys = rng.random((len(chunkRows), len(candidates)))
+        keyRows, keyColumns = numpy.nonzero(chunkPositions >= 0)
+        keys[keyRows, chunkPositions[keyRows, keyColumns]] = 2.0
+        matrix[chunkRows] = chooseSmallestKeys(candidates, fileOfQuestion, needed, keys)
+    return matrix, filledRows
+
+def chooseSetMatrix(plannedSet, numberOfTests, rng):
+    """
+    Chooses a set's questions for many tests at once, returning a matrix with
+    a row of question indices for each test, grouped by the file they came from.
+    Each possible selection is equally likely, and questions from the same file
+    are in a random order, like TestPlan.sample.
+    
+    When the set is big compared to the number of questions chosen, each row is
+    drawn allowing repeats and the few rows that got one are drawn again.
+    Otherwise every question gets a random key and the ones with the smallest
+    keys are chosen, a chunk of rows at a time so the keys never take more than
+    about BATCH_SELECTION_CHUNK_SIZE numbers.
+    
+    plannedSet = the set to choose from
+    numberOfTests = the number of rows
+    rng = the numpy.random.Generator to choose with
+    """
+    candidates = numpy.frombuffer(plannedSet["distinct questions"], dtype=numpy.int32)
+    fileOfQuestion = numpy.frombuffer(plannedSet["file of question"], dtype=numpy.int32)
+    needed = plannedSet["number of questions"]
+    if needed == 0:
+        return numpy.empty((numberOfTests, 0), dtype=numpy.int32)
+    
+    if needed * needed <= len(candidates):
+        #at most about half of the rows have a repeat, and far fewer when the set is much bigger
+        picked = rng.integers(0, len(candidates), (numberOfTests, needed))
+        repeatRows = numpy.arange(numberOfTests)
+        while len(repeatRows) > 0:
+            sortedPicks = numpy.sort(picked[repeatRows], axis=1)
+            repeatRows = repeatRows[(sortedPicks[:, 1:] == sortedPicks[:, :-1]).any(axis=1)]
+            picked[repeatRows] = rng.integers(0, len(candidates), (len(repeatRows), needed))
+        chosen = candidates[picked]
+        order = numpy.argsort(fileOfQuestion[chosen], axis=1, kind="stable")
+        return numpy.take_along_axis(chosen, order, axis=1)
+    
+    chunks = []
+    rowsPerChunk = max(1, BATCH_SELECTION_CHUNK_SIZE // len(candidates))
+    for firstRow in range(0, numberOfTests, rowsPerChunk):
+        keys = rng.random((min(rowsPerChunk, numberOfTests - firstRow), len(candidates)))
+        chunks.append(chooseSmallestKeys(candidates, fileOfQuestion, needed, keys))
+    return numpy.concatenate(chunks)
+
+def chooseSmallestKeys(candidates, fileOfQuestion, needed, keys):
+    """
+    Returns a matrix with a row for each row of keys, holding the needed
+    candidates with the smallest keys, grouped by the file they came from and
+    in key order within a file.
+    
+    candidates = array of the question indices to choose from
+    fileOfQuestion = array of the file of each question in the set
+    needed = how many questions to choose for each row
+    keys = matrix with a random key for each candidate in each row
+    """
+    picked = numpy.argpartition(keys, needed - 1, axis=1)[:, :needed]
+    chosen = candidates[picked]
+    order = numpy.lexsort((numpy.take_along_axis(keys, picked, axis=1), fileOfQuestion[chosen]), axis=-1)
+    return numpy.take_along_axis(chosen, order, axis=1)
+
+def simulateExposure(config, testPlan, numberOfTests, seed=None):
+    """
+    Chooses questions for a large number of simulated tests with NumPy, without
+    rendering or writing anything, and measures how evenly the questions and
+    files are used and how much pairs of tests overlap.  Tests are simulated a
+    chunk of SIMULATION_CHUNK_SIZE at a time, so memory doesn't grow with their
+    number.  Returns the results as a dictionary that can be saved as JSON:
+        "simulated tests" = numberOfTests
+        "questions" = for each question, its "id", "file path", "line", and the
+                      "frequency" of tests it is on, least used first
+        "files" = for each file of each set, the "set" number, "file path", the
+                  "frequency" of tests with a question from it, and the average
+                  "questions per test" from it
+        "overlap" = the "pairs" of tests compared, and the "distribution" of how
+                    many questions they share, as the fraction of pairs sharing
+                    0, 1, 2, ... questions
+    
+    config = the configuration testPlan was made from
+    testPlan = the TestPlan to choose questions from
+    numberOfTests = the number of tests to simulate
+    seed = seed for NumPy's random number generator, or None to seed from the system
+    """
+    rng = numpy.random.default_rng(seed)
+    
+    #the same question in several sets or files is counted as one
+    numberArrays = questionNumberArrays(testPlan)
+    questionIds = list(dict.fromkeys(itertools.chain.from_iterable(plannedSet["question ids"] for plannedSet in testPlan.sets)))
+    questionsPerTest = sum(plannedSet["number of questions"] for plannedSet in testPlan.sets)
+    questionCounts = numpy.zeros(len(questionIds), dtype=numpy.int64)
+    fileTestCounts = [numpy.zeros(len(plannedSet["instructions tex"]), dtype=numpy.int64) for plannedSet in testPlan.sets]
+    fileQuestionCounts = [numpy.zeros(len(plannedSet["instructions tex"]), dtype=numpy.int64) for plannedSet in testPlan.sets]
+    overlapCounts = numpy.zeros(questionsPerTest + 1, dtype=numpy.int64)
+    
+    for firstTest in range(0, numberOfTests, SIMULATION_CHUNK_SIZE):
+        chunkSize = min(SIMULATION_CHUNK_SIZE, numberOfTests - firstTest)
+        matrices = chooseSelectionMatrices(testPlan, chunkSize, rng, numberArrays)
+        chosenNumbers = numpy.concatenate([numberArray[matrix] for numberArray, matrix in zip(numberArrays, matrices)], axis=1)
+        questionCounts += numpy.bincount(chosenNumbers.ravel(), minlength=len(questionIds))
+        
+        #a file is on a test if it is the first of its run in the row's sorted files
+        for setIndex, (plannedSet, matrix) in enumerate(zip(testPlan.sets, matrices)):
+            chosenFiles = numpy.sort(numpy.frombuffer(plannedSet["file of question"], dtype=numpy.int32)[matrix], axis=1)
+            firstOfFile = numpy.ones(chosenFiles.shape, dtype=bool)
+            firstOfFile[:, 1:] = chosenFiles[:, 1:] != chosenFiles[:, :-1]
+            fileTestCounts[setIndex] += numpy.bincount(chosenFiles[firstOfFile], minlength=len(fileTestCounts[setIndex]))
+            fileQuestionCounts[setIndex] += numpy.bincount(chosenFiles.ravel(), minlength=len(fileQuestionCounts[setIndex]))
+        
+        #the first half of the chunk is paired with the second half, so every pair is independent
+        half = chunkSize // 2
+        pairRows = max(1, SIMULATION_CHUNK_SIZE // max(1, questionsPerTest * questionsPerTest))
+        for firstPair in range(0, half, pairRows):
+            firstTests = chosenNumbers[firstPair:min(half, firstPair + pairRows)]
+            secondTests = chosenNumbers[half + firstPair:half + min(half, firstPair + pairRows)]
+            shared = (firstTests[:, :, None] == secondTests[:, None, :]).sum(axis=(1, 2))
+            overlapCounts += numpy.bincount(numpy.minimum(shared, questionsPerTest), minlength=questionsPerTest + 1)
+    
+    questions = []
+    for questionNumber in numpy.argsort(questionCounts, kind="stable").tolist():
+        location = testPlan.questionIndex[questionIds[questionNumber]]
+        questions.append({"id":questionIds[questionNumber], "file path":location["file path"], "line":location["line"], "frequency":questionCounts[questionNumber].item() / numberOfTests})
+    files = []
+    for setIndex, questionSet in enumerate(config["question sets"]):
+        for fileIndex, questionFile in enumerate(questionSet["question files"]):
+            files.append({
+                "set":setIndex + 1,
+                "file path":questionFile["file path"],
+                "frequency":fileTestCounts[setIndex][fileIndex].item() / numberOfTests,
+                "questions per test":fileQuestionCounts[setIndex][fileIndex].item() / numberOfTests
+            })
+    pairs = overlapCounts.sum().item()
+    return {
+        "simulated tests":numberOfTests,
+        "questions":questions,
+        "files":files,
+        "overlap":{"pairs":pairs, "distribution":[count / max(1, pairs) for count in overlapCounts.tolist()]}
+    }
+
+def printExposureReport(report):
+    """
+    Prints a summary of the results of simulateExposure.
+    """
+    questions = report["questions"]
+    print("Simulated " + str(report["simulated tests"]) + " tests")
+    print(DIVIDER)
+    print(str(len(questions)) + " different questions, each on between " + format(questions[0]["frequency"], ".3%") + " and " + format(questions[-1]["frequency"], ".3%") + " of tests")
+    listed = min(SIMULATION_LISTED_QUESTIONS, len(questions))
+    print("Least used questions:")
+    for question in questions[:listed]:
+        print("\t" + format(question["frequency"], ".3%") + "\t" + question["file path"] + " line " + str(question["line"]))
+    print("Most used questions:")
+    for question in reversed(questions[-listed:]):
+        print("\t" + format(question["frequency"], ".3%") + "\t" + question["file path"] + " line " + str(question["line"]))
+    print(DIVIDER)
+    print("Question files, with how many tests have a question from them and how many questions they give a test on average:")
+    for questionFile in report["files"]:
+        print("\tSet " + str(questionFile["set"]) + ": " + questionFile["file path"] + "\t" + format(questionFile["frequency"], ".2%") + "\t" + format(questionFile["questions per test"], ".2f"))
+    print(DIVIDER)
+    distribution = report["overlap"]["distribution"]
+    print("Questions shared by two tests, out of " + str(len(distribution) - 1) + ", over " + str(report["overlap"]["pairs"]) + " pairs of tests:")
+    
+    #no pair shares more than the last count listed
+    mostShared = max(shared for shared, fraction in enumerate(distribution) if fraction > 0)
+    for shared in range(0, mostShared + 1):
+        print("\t" + str(shared) + ":\t" + format(distribution[shared], ".3%") + " of pairs")
+    print("\tAverage: " + format(sum(shared * fraction for shared, fraction in enumerate(distribution)), ".3f"))
+
+def writeCombinedTests(testPlan, outputDir, versions):
+    """
+    Writes a batch of tests into a single test document and a single answer key
+    document, so a whole batch is one compile and one print job.  The preamble
+    appears once; each version starts on a new page with its own title, and its
+    page and question numbers start again from 1.  The last page is an index of
+    which pages of the document each version is on.
+    
+    Returns the names of the (test document, answer key document) in the output directory.
+    
+    testPlan = the TestPlan to make the tests from
+    outputDir = the output directory
+    versions = list of (version number, seed, chosen questions or None to choose them with the seed) to write, in order
+    """
+    combinedName = "tests_" + str(versions[0][0]) + "-" + str(versions[-1][0])
+    testName = combinedName + ".tex"
+    answerName = combinedName + ANSWER_KEY_FILE_SUFFIX
+    
+    #the header is split into the preamble, which only appears once, and the title, which is repeated for each version
+    testPreamble, testTitle = splitHeader(testPlan.testHeader)
+    answerPreamble, answerTitle = splitHeader(testPlan.answerHeader)
+    
+    with open(outputDir / testName, "w") as testOut, open(outputDir / answerName, "w") as answerOut:
+        testOut.write(testPreamble + TEX_BEGIN_DOCUMENT + "\n" + TEX_COMBINED_SETUP)
+        answerOut.write(answerPreamble + TEX_BEGIN_DOCUMENT + "\n" + TEX_COMBINED_SETUP)
+        for testNumber, versionSeed, chosenQuestionsBySet in versions:
+            if chosenQuestionsBySet is None:
+                chosenQuestionsBySet = testPlan.sample(random.Random(versionSeed))
+            testOut.write("\\gatewaymakerStartVersion\n" + testTitle.replace("%%VERSION_NUMBER%%", str(testNumber)) + "\n")
+            answerOut.write("\\gatewaymakerStartVersion\n" + answerTitle.replace("%%VERSION_NUMBER%%", str(testNumber) + " ANSWER KEY") + "\n")
+            writeTestBody(testPlan, chosenQuestionsBySet, testOut, answerOut)
+            testOut.write("\\gatewaymakerEndVersion{" + str(testNumber) + "}\n\n")
+            answerOut.write("\\gatewaymakerEndVersion{" + str(testNumber) + "}\n\n")
+        testOut.write(TEX_COMBINED_INDEX + TEX_END_DOCUMENT)
+        answerOut.write(TEX_COMBINED_INDEX + TEX_END_DOCUMENT)
+        instrumentCount("bytes written", testOut.tell() + answerOut.tell())
+    instrumentCount("versions written", len(versions))
+    return testName, answerName
+
+def writeArchivedTests(testPlan, outputDir, versions):
+    """
+    Writes a batch of tests, their answer keys and the batch's manifest records
+    into a single compressed zip archive, as one sequential write instead of a
+    pair of small files per test.  Returns the name of the archive in the output
+    directory.  Use listArchivedVersions and extractArchivedVersion to get tests
+    back out.
+    
+    testPlan = the TestPlan to make the tests from
+    outputDir = the output directory
+    versions = list of (version number, seed, chosen questions or None to choose them with the seed) to write, in order
+    """
+    archiveName = "tests_" + str(versions[0][0]) + "-" + str(versions[-1][0]) + ".zip"
+    with zipfile.ZipFile(outputDir / archiveName, "x", zipfile.ZIP_DEFLATED) as archive:
+        for testNumber, versionSeed, chosenQuestionsBySet in versions:
+            if chosenQuestionsBySet is None:
+                chosenQuestionsBySet = testPlan.sample(random.Random(versionSeed))
+            #a zip can only have one entry open at a time, so one version is rendered in memory and then added
+            testOut = io.StringIO()
+            answerOut = io.StringIO()
+            renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut)
+            testName, answerName = versionFileNames(testNumber)
+            archive.writestr(testName, testOut.getvalue())
+            archive.writestr(answerName, answerOut.getvalue())
+        
+        #the batch's own manifest, so the archive can be understood on its own
+        manifestOut = io.StringIO()
+        writeManifestLines(manifestOut, testPlan, versions)
+        archive.writestr(VERSION_MANIFEST_FILE_NAME, manifestOut.getvalue())
+    instrumentCount("bytes written", (outputDir / archiveName).stat().st_size)
+    instrumentCount("versions written", len(versions))
+    return archiveName
+
+def listArchivedVersions(archivePath):
+    """
+    Returns the sorted version numbers of the tests in an archive made by writeArchivedTests.
+    
+    archivePath = path of the archive
+    """
+    testNumbers = set()
+    with zipfile.ZipFile(archivePath, "r") as archive:
+        for name in archive.namelist():
+            match = TEST_FILE_NAME_PATTERN.fullmatch(name)
+            if match:
+                testNumbers.add(int(match.group(1)))
+    return sorted(testNumbers)
+
+def extractArchivedVersion(archivePath, testNumber, destinationDir):
+    """
+    Extracts one version's test and answer key from an archive made by
+    writeArchivedTests into a directory.  Raises KeyError if the version isn't
+    in the archive.
+    
+    archivePath = path of the archive
+    testNumber = the version number to extract
+    destinationDir = the directory to extract the files into
+    """
+    destinationDir = pathlib.Path(destinationDir)
+    destinationDir.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(archivePath, "r") as archive:
+        for name in versionFileNames(testNumber):
+            (destinationDir / name).write_bytes(archive.read(name))
+
+def splitHeader(header):
+    """
+    Splits a LaTeX header into (the preamble, the title), the parts before and
+    after \\begin{document}.  Raises ValueError if there is no \\begin{document}.
+    """
+    preamble, beginDocument, title = header.partition(TEX_BEGIN_DOCUMENT)
+    if not beginDocument:
+        raise ValueError("no " + TEX_BEGIN_DOCUMENT + " in the header")
+    return preamble, title
+
+def appendManifest(outputDir, testPlan, versions):
+    """
+    Records versions in the output directory's manifest, one JSON object per line
+    holding the version number, its seed, and the hashes of the configuration and
+    question bank it was made from.  That is all regenerateVersion needs to make
+    the version again.  Versions whose questions weren't chosen from the seed alone
+    also record the IDs of the questions chosen for each set, as "selection".
+    
+    outputDir = the output directory
+    testPlan = the TestPlan the versions were made from
+    versions = iterable of (version number, seed, chosen questions or None if they were chosen with the seed)
+    """
+    manifestOut = io.StringIO()
+    writeManifestLines(manifestOut, testPlan, versions)
+    with lockOutputDir(outputDir):
+        with open(pathlib.Path(outputDir) / VERSION_MANIFEST_FILE_NAME, "a+") as fout:
+            #a run killed part way through a line leaves it unfinished, so start on a new line rather than join it
+            if fout.tell() > 0:
+                fout.seek(fout.tell() - 1)
+                if fout.read(1) != "\n":
+                    fout.write("\n")
+            fout.write(manifestOut.getvalue())
+
+def writeManifestLines(manifestOut, testPlan, versions):
+    """
+    Writes the manifest records for versions, in the format described in appendManifest.
+    
+    manifestOut = file to write the records to
+    testPlan = the TestPlan the versions were made from
+    versions = iterable of (version number, seed, chosen questions or None if they were chosen with the seed)
+    """
+    for testNumber, versionSeed, chosenQuestionsBySet in versions:
+        record = {"version":testNumber, "seed":versionSeed, "config hash":testPlan.configHash, "question bank hash":testPlan.bankHash}
+        if chosenQuestionsBySet is not None:
+            record["selection"] = testPlan.selectionIds(chosenQuestionsBySet)
+        manifestOut.write(json.dumps(record) + "\n")
+
+def parseManifestLine(outputDir, lineNumber, line):
+    """
+    Returns the record on a line of the manifest, or None with a warning if the
+    line can't be read, such as the last line of a run that was killed part way
+    through writing it.
+    
+    outputDir = the output directory the manifest is in
+    lineNumber = the line's number in the manifest, for the warning
+    line = the line
+    """
+    try:
+        record = json.loads(line)
+        if isinstance(record, dict) and isinstance(record.get("version"), int):
+            return record
+    except ValueError:
+        pass
+    print("WARNING: skipping unreadable line " + str(lineNumber) + " of the manifest in " + str(outputDir))
+    return None
+
+def readManifest(outputDir):
+    """
+    Returns every record in the output directory's manifest, as a dictionary from
+    version number to record.  Empty if there is no manifest.
+    
+    outputDir = the output directory
+    """
+    records = {}
+    try:
+        with open(pathlib.Path(outputDir) / VERSION_MANIFEST_FILE_NAME, "r") as fin:
+            for lineNumber, line in enumerate(fin, 1):
+                record = parseManifestLine(outputDir, lineNumber, line)
+                if record is not None:
+                    records[record["version"]] = record #the last record for a version wins
+    except FileNotFoundError:
+        pass
+    return records
+
+def readManifestRecord(outputDir, testNumber):
+    """
+    Returns the manifest record for a version, or None if it isn't in the manifest.
+    
+    outputDir = the output directory
+    testNumber = the version number
+    """
+    #the version number is always first, so lines for other versions can be skipped without parsing them
+    prefix = '{"version": ' + str(testNumber) + ','
+    record = None
+    try:
+        with open(pathlib.Path(outputDir) / VERSION_MANIFEST_FILE_NAME, "r") as fin:
+            for lineNumber, line in enumerate(fin, 1):
+                if line.startswith(prefix):
+                    record = parseManifestLine(outputDir, lineNumber, line) or record #keep going, the last record for a version wins
+    except FileNotFoundError:
+        pass
+    return record
+
+def regenerateVersion(config, outputDir, testNumber, cachePath=QUESTION_CACHE_FILE_PATH, compileSettings=None, testPlan=None):
+    """
+    Makes a version recorded in the output directory's manifest again, writing
+    its test and answer key into the output directory.  Exits with an error
+    message if the version isn't in the manifest, or if the configuration or
+    question files have changed since it was made.  Raises CompileError if
+    compiling was asked for and failed.
+    
+    config = config file for the program
+    outputDir = the output directory holding the manifest
+    testNumber = the version number to make again
+    cachePath = path of the parsed question file cache, or None to always parse the files
+    compileSettings = settings for compileTests to compile the version to PDF afterwards, or None to leave it as .tex
+    testPlan = the TestPlan for config if it has already been loaded, or None to load it
+    """
+    outputDir = pathlib.Path(outputDir)
+    record = readManifestRecord(outputDir, testNumber)
+    if record is None:
+        print("ERROR: version " + str(testNumber) + " is not in the manifest in " + str(outputDir))
+        waitAndExit(1)
+    
+    if testPlan is None:
+        testPlan = loadTestPlan(config, cachePath)
+    if record["config hash"] != testPlan.configHash:
+        print("ERROR: the configuration or headers have changed since version " + str(testNumber) + " was made, so it can't be made again.")
+        waitAndExit(1)
+    if record["question bank hash"] != testPlan.bankHash:
+        print("ERROR: the question files have changed since version " + str(testNumber) + " was made, so it can't be made again.")
+        waitAndExit(1)
+    
+    try:
+        chosenQuestionsBySet = testPlan.selectionFromIds(record["selection"]) if "selection" in record else None
+        makeVersion(testPlan, outputDir, record["seed"], testNumber, overwrite=True, chosenQuestionsBySet=chosenQuestionsBySet)
+    except IOError:
+        print("ERROR: could not write out the test file, please check write permissions.")
+        waitAndExit(1)
+    print("Created 'test_" + str(testNumber) + ".tex' and 'test_" + str(testNumber) + "_answers.tex'")
+    
+    if compileSettings is not None:
+        failedFiles = compileTests(testPlan, outputDir, versionFileNames(testNumber), compileSettings)
+        if failedFiles:
+            raise CompileError(failedFiles, [testNumber])
+
+def reportCreatedVersions(testPlan, outputDir, versions, createdVersions):
+    """
+    Prints the tests as they are created.  Any test whose files turned out to
+    already exist is made again here under a newly reserved version number.
+    
+    testPlan = the TestPlan the tests are made from
+    outputDir = the output directory
+    versions = list of (reserved version number, seed, chosen questions or None) for each test
+    createdVersions = iterable of whether each test was created, in the same order
+    
+    Returns a list of the (version number, seed, chosen questions or None) of each test actually written.
+    """
+    writtenVersions = []
+    for (testNumber, versionSeed, chosenQuestionsBySet), created in zip(versions, createdVersions):
+        #someone put files there behind our back, so find out what is really free
+        while not created:
+            testNumber = reserveVersionNumbers(outputDir, 1, rescan=True)
+            created = makeVersion(testPlan, outputDir, versionSeed, testNumber, chosenQuestionsBySet=chosenQuestionsBySet)
+        print("Created 'test_" + str(testNumber) + ".tex' and 'test_" + str(testNumber) + "_answers.tex'")
+        writtenVersions.append((testNumber, versionSeed, chosenQuestionsBySet))
+    return writtenVersions
+
+def makeVersion(testPlan, outputDir, versionSeed, testNumber, overwrite=False, chosenQuestionsBySet=None):
+    """
+    Chooses the questions for one test and writes the test and answer key.
+    Returns False without writing anything if the files for that version
+    already exist, True otherwise.  Raises IOError if the files can't be written.
+    
+    testPlan = the TestPlan to make the test from
+    outputDir = the output directory
+    versionSeed = the seed to choose the questions with
+    testNumber = the version number to write the test as
+    overwrite = True to replace the files if they already exist
+    chosenQuestionsBySet = the questions already chosen for the test, or None to choose them with the seed
+    """
+    if activeInstrumentation is not None:
+        return makeInstrumentedVersion(testPlan, outputDir, versionSeed, testNumber, overwrite, chosenQuestionsBySet)
+    
+    if chosenQuestionsBySet is None:
+        chosenQuestionsBySet = testPlan.sample(random.Random(versionSeed))
+    try:
+        testOut, answerOut = createVersionFiles(outputDir, testNumber, overwrite)
+    except FileExistsError:
+        return False
+    with testOut, answerOut:
+        renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut)
+    return True
+
+def makeInstrumentedVersion(testPlan, outputDir, versionSeed, testNumber, overwrite, chosenQuestionsBySet):
+    """
+    makeVersion while instrumentation is active.  The test is rendered in memory
+    before it is written, so that rendering and writing can be timed separately.
+    """
+    startTime = time.perf_counter()
+    with instrumentStage("sample"):
+        if chosenQuestionsBySet is None:
+            chosenQuestionsBySet = testPlan.sample(random.Random(versionSeed))
+    with instrumentStage("render"):
+        testOut = io.StringIO()
+        answerOut = io.StringIO()
+        renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut)
+    with instrumentStage("write"):
+        try:
+            testFile, answerFile = createVersionFiles(outputDir, testNumber, overwrite)
+        except FileExistsError:
+            return False
+        with testFile, answerFile:
+            testFile.write(testOut.getvalue())
+            answerFile.write(answerOut.getvalue())
+    instrumentCount("bytes written", len(testOut.getvalue()) + len(answerOut.getvalue()))
+    instrumentCount("versions written")
+    activeInstrumentation.versionSeconds[testNumber] = time.perf_counter() - startTime
+    return True
+
+def writeVersionsInBackground(testPlan, outputDir, versions):
+    """
+    Chooses the questions for and renders each version, handing them to a
+    BackgroundWriter so that writing one version overlaps rendering the next.
+    Stops at the first version that can't be written.  Returns (the same as
+    reportCreatedVersions for the versions that were written, the IOError that
+    stopped it or None).
+    
+    testPlan = the TestPlan to make the tests from
+    outputDir = the output directory
+    versions = list of (reserved version number, seed, chosen questions or None) for each test
+    """
+    writer = BackgroundWriter(outputDir)
+    try:
+        for testNumber, versionSeed, chosenQuestionsBySet in versions:
+            with instrumentStage("sample"):
+                if chosenQuestionsBySet is None:
+                    chosenQuestionsBySet = testPlan.sample(random.Random(versionSeed))
+            with instrumentStage("render"):
+                testOut = io.StringIO()
+                answerOut = io.StringIO()
+                renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut)
+            writer.write(testNumber, testOut.getvalue(), answerOut.getvalue())
+    except IOError:
+        pass #the writer keeps the error, and what it wrote before it still has to be reported
+    finally:
+        createdVersions = writer.close()
+    writtenVersions = [version for version in versions if version[0] in createdVersions]
+    return reportCreatedVersions(testPlan, outputDir, writtenVersions, (createdVersions[testNumber] for testNumber, versionSeed, chosenQuestionsBySet in writtenVersions)), writer.error
+
+class BackgroundWriter:
+    """
+    Writes rendered versions to disk from a background thread.  Versions wait
+    in a queue of at most WRITER_QUEUE_SIZE, so memory stays bounded however
+    many are made; when it is full, write waits for the disk to catch up.
+    
+    The thread takes up to WRITER_BATCH_SIZE versions at a time, writes all
+    of their files, and then flushes the whole batch to disk before starting on
+    the next, so the disk can work on the files together.  An error in the
+    thread isn't reported there; it is kept in error, as an IOError whatever it
+    was, and raised from the next call to write.  The files of the batch that
+    failed are removed and any versions after it are dropped, so only versions
+    that are safely on disk are ever counted as created.  If the thread stops
+    some other way, write and close notice instead of waiting on it forever.
+    """
+    
+    def __init__(self, outputDir):
+        """
+        outputDir = the output directory
+        """
+        self.outputDir = pathlib.Path(outputDir)
+        self.queue = queue.Queue(WRITER_QUEUE_SIZE)
+        self.createdVersions = {}
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    
+    def write(self, testNumber, testTex, answerTex):
+        """
+        Queues a version to be written, waiting if the queue is full.  Raises
+        IOError if writing an earlier version failed.
+        
+        testNumber = the version number
+        testTex = the whole test document
+        answerTex = the whole answer key document
+        """
+        self.put((testNumber, testTex, answerTex))
+        if self.error is not None:
+            raise self.error
+    
+    def close(self):
+        """
+        Waits for every queued version to be written.  Returns a dictionary from
+        version number to whether it was created, False if its files already
+        existed.  If writing failed, only the versions written before the batch
+        that failed are in it, and the IOError is in error.
+        """
+        self.put(None)
+        self.thread.join()
+        return self.createdVersions
+    
+    def put(self, item):
+        """
+        Puts an item on the queue, waiting if it is full but giving up with
+        error set if the thread has stopped and will never empty it.
+        """
+        while self.error is None or item is None:
+            if not self.thread.is_alive():
+                if self.error is None:
+                    self.error = IOError("the background writer stopped unexpectedly")
+                return
+            try:
+                self.queue.put(item, timeout=WRITER_POLL_SECONDS)
+                return
+            except queue.Full:
+                pass
+    
+    def run(self):
+        """
+        The background thread: writes batches from the queue until close is called.
+        """
+        while True:
+            #take whatever else is already waiting, up to a batch
+            batch = [self.queue.get()]
+            while batch[-1] is not None and len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            finished = batch[-1] is None
+            if finished:
+                batch.pop()
+            
+            #after an error the queue is still emptied, so write never waits on a thread that has given up
+            if batch and self.error is None:
+                try:
+                    with instrumentStage("write (background)"):
+                        self.writeBatch(batch)
+                except IOError as e:
+                    self.error = e
+                except Exception as e:
+                    #anything else, like text the file's encoding can't hold, still has to reach the caller
+                    self.error = IOError("could not write versions: " + type(e).__name__ + ": " + str(e))
+                    self.error.__cause__ = e
+            if finished:
+                return
+    
+    def writeBatch(self, batch):
+        """
+        Writes the files for a batch of versions and flushes them to disk.  If
+        that fails, the files it made are removed again before raising.
+        """
+        openFiles = []
+        batchCreated = {}
+        try:
+            for testNumber, testTex, answerTex in batch:
+                try:
+                    testOut, answerOut = createVersionFiles(self.outputDir, testNumber)
+                except FileExistsError:
+                    batchCreated[testNumber] = False
+                    continue
+                except IOError as e:
+                    raise IOError("could not write version " + str(testNumber) + ": " + str(e)) from e
+                openFiles.extend((testOut, answerOut))
+                batchCreated[testNumber] = True
+                testOut.write(testTex)
+                answerOut.write(answerTex)
+                instrumentCount("bytes written", len(testTex) + len(answerTex))
+                instrumentCount("versions written")
+            
+            #hand all of the batch to the operating system before waiting on any of it
+            for openFile in openFiles:
+                openFile.flush()
+            for openFile in openFiles:
+                os.fsync(openFile.fileno())
+        except Exception:
+            #versions that might not be on disk aren't recorded in the manifest, so their files can't be left behind either
+            for openFile in openFiles:
+                with contextlib.suppress(IOError):
+                    openFile.close()
+                with contextlib.suppress(IOError):
+                    os.remove(openFile.name)
+            raise
+        finally:
+            for openFile in openFiles:
+                openFile.close()
+        self.createdVersions.update(batchCreated)
+        
+        #the new files' names are only safe on disk once the directory is too, where the system allows it
+        try:
+            directoryHandle = os.open(self.outputDir, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(directoryHandle)
+        except OSError:
+            pass
+        finally:
+            os.close(directoryHandle)
+
+def renderVersion(testPlan, testNumber, chosenQuestionsBySet, testOut, answerOut):
+    """
+    Writes a whole test and answer key document for one version.
+    
+    testPlan = the TestPlan the questions were chosen from
+    testNumber = the version number
+    chosenQuestionsBySet = the questions chosen for each set, as returned by TestPlan.sample
+    testOut = file to write the test to
+    answerOut = file to write the answer key to
+    """
+    #the version number only ever appears in the header, so there is no need to search the whole document for it
+    testOut.write(testPlan.testHeader.replace("%%VERSION_NUMBER%%", str(testNumber)) + "\n")
+    answerOut.write(testPlan.answerHeader.replace("%%VERSION_NUMBER%%", str(testNumber) + " ANSWER KEY") + "\n")
+    writeTestBody(testPlan, chosenQuestionsBySet, testOut, answerOut)
+    testOut.write(TEX_END_DOCUMENT)
+    answerOut.write(TEX_END_DOCUMENT)
 
-TEX_ANSWERBOX_HEIGHT = "1.6cm"
-TEX_ANSWERBOX_WIDTH = "3cm"
-TEX_SPACING = "    "
-TEX_BEGIN_QUESTIONS = "\\begin{questions}"
-TEX_END_QUESTIONS = "\\end{questions}"
-TEX_ANSWER_BOX_EMPTY = "%\\\\[.3in] \\vspace*{-10ex} \n" + TEX_SPACING + "\\begin{flushright} \\fbox{\\rule[0cm]{0cm}{" + TEX_ANSWERBOX_HEIGHT + "} \\hspace{" + TEX_ANSWERBOX_WIDTH + "} } \\end{flushright} "
-TEX_ANSWER_BOX_FULL_START = "%\\\\[.3in] \\vspace*{-10ex} \n" + TEX_SPACING + "\\begin{flushright} \\fbox{\\rule[0cm]{0cm}{0cm} \\begin{minipage}[0pt][" + TEX_ANSWERBOX_HEIGHT + "][c]{" + TEX_ANSWERBOX_WIDTH + "} \\begin{center}"
-TEX_ANSWER_BOX_FULL_END = "\end{center} \\end{minipage}} \\end{flushright}"
-TEX_ITEM = "\\item "
-TEX_END_DOCUMENT = "\\end{document}"
-TEX_INSTRUCTION_START = "\\noindent \\bf{"
-TEX_INSTRUCTION_END = "}"
-TEX_NEWPAGE = "\\newpage"
+#the plan and output directory for a worker process, set once by initVersionWorker
+workerTestPlan = None
+workerOutputDir = None
 
+def initVersionWorker(testPlan, outputDir):
+    """
+    Runs once in each worker process to store what every test needs.
+    """
+    global workerTestPlan, workerOutputDir, activeInstrumentation
+    activeInstrumentation = None #a forked worker would otherwise record into a copy nobody sees
+    workerTestPlan = testPlan
+    workerOutputDir = outputDir
 
-def waitAndExit(exitCode):
+def makeVersionInWorker(versionSeed, testNumber, chosenQuestionsBySet):
     """
-    Called to wait for the user to press enter, then exits with exitCode.
-    Good for users who double click to run the program, and may not see
-    any error messages if the program doesn't wait.
+    makeVersion for a worker process, using the plan from initVersionWorker.
     """
-    input("Press the 'Enter' key to exit...")
-    exit(exitCode)
+    return makeVersion(workerTestPlan, workerOutputDir, versionSeed, testNumber, chosenQuestionsBySet=chosenQuestionsBySet)
 
-def createTests(config, numberOfTests):
+@contextlib.contextmanager
+def lockOutputDir(outputDir):
     """
-    Create the given number of tests and answer keys based on the current configuration.
+    Holds a lock on a file in the output directory for the duration of a with
+    block, so that concurrent runs, or threads, don't hand out the same version
+    numbers.  The lock is the operating system's, so it is released when its
+    holder exits, even if it crashed.  The lock file itself is left in place,
+    since removing it would let a run lock a new file while another still waits
+    on the old one.
     
-    testConfig = config file for the program
-    numberOfTests = number of tests to create
+    outputDir = the output directory to lock
     """
-    #its convenient to store the actual LaTeX with the configuration, but then we will write that to file if we edit the configuration after making a test
-    testConfig = copy.deepcopy(config)
+    lockFile = os.open(pathlib.Path(outputDir) / VERSION_LOCK_FILE_NAME, os.O_CREAT | os.O_RDWR)
+    try:
+        if fcntl is not None:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+        else:
+            #msvcrt only waits about ten seconds for a lock before giving up, so keep asking
+            while True:
+                try:
+                    msvcrt.locking(lockFile, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
+            else:
+                os.lseek(lockFile, 0, os.SEEK_SET)
+                msvcrt.locking(lockFile, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(lockFile)
+
+def scanVersionNumbers(outputDir):
+    """
+    Returns the largest version number of any test or answer key in the output
+    directory or its manifest, or 0 if there are none.  Only used when the version counter is
+    missing or out of date, since it has to list the whole directory.
     
-    #read in the latex headers
-    testHeader = ""
+    outputDir = the output directory to scan
+    """
+    largestNumber = 0
+    with os.scandir(outputDir) as entries:
+        for entry in entries:
+            instrumentCount("directory entries scanned")
+            match = TEST_FILE_NAME_PATTERN.fullmatch(entry.name)
+            if match:
+                largestNumber = max(largestNumber, int(match.group(1)))
+    
+    #versions that were only recorded in the manifest have no files, but their numbers are still taken
     try:
-        with open(TEST_HEADER_FILE_PATH, "r") as fin:
-            testHeader = fin.read()
-    except IOError:
-        print("ERROR: Couldn't read the latex header file at " + str(TEST_HEADER_FILE_PATH))
-        waitAndExit(1)
+        with open(pathlib.Path(outputDir) / VERSION_MANIFEST_FILE_NAME, "r") as fin:
+            for lineNumber, line in enumerate(fin, 1):
+                record = parseManifestLine(outputDir, lineNumber, line)
+                if record is not None:
+                    largestNumber = max(largestNumber, record["version"])
+    except FileNotFoundError:
+        pass
+    return largestNumber
+
+def reserveVersionNumbers(outputDir, count, rescan=False):
+    """
+    Reserves count consecutive version numbers in the output directory and returns
+    the first.  The next free number is kept in a counter file in the output
+    directory, so this doesn't depend on how many tests are already there; the
+    directory is only scanned if the counter is missing or rescan is set.
+    
+    outputDir = the output directory, which must already exist
+    count = how many version numbers to reserve
+    rescan = True to also scan the directory, for when the counter turned out to be wrong
+    """
+    counterPath = pathlib.Path(outputDir) / VERSION_COUNTER_FILE_NAME
+    with lockOutputDir(outputDir):
+        try:
+            nextNumber = int(counterPath.read_text())
+        except (IOError, ValueError):
+            nextNumber = None
+        if nextNumber is None or rescan:
+            nextNumber = max(nextNumber or 1, scanVersionNumbers(outputDir) + 1)
         
-    answerHeader = ""
+        #the counter is never half written
+        replaceFile(counterPath, str(nextNumber + count))
+    return nextNumber
+
+def versionFileNames(testNumber):
+    """
+    Returns the file names of the (test, answer key) for a version.
+    """
+    return "test_" + str(testNumber) + ".tex", "test_" + str(testNumber) + ANSWER_KEY_FILE_SUFFIX
+
+def createVersionFiles(outputDir, testNumber, overwrite=False):
+    """
+    Creates and opens the test and answer key files for a version, returning them as
+    (test file, answer key file).  Unless overwrite is set, raises FileExistsError
+    without leaving anything behind if either file already exists.
+    
+    outputDir = the output directory
+    testNumber = the version number
+    overwrite = True to replace existing files
+    """
+    mode = "w" if overwrite else "x"
+    testName, answerName = versionFileNames(testNumber)
+    testOut = open(outputDir / testName, mode)
     try:
-        with open(ANSWER_KEY_HEADER_FILE_PATH, "r") as fin:
-            answerHeader = fin.read()
-    except IOError:
-        print("ERROR: Couldn't read the latex header file at " + str(ANSWER_KEY_HEADER_FILE_PATH))
-        waitAndExit(1)
+        answerOut = open(outputDir / answerName, mode)
+    except Exception:
+        testOut.close()
+        os.remove(testOut.name)
+        raise
+    return testOut, answerOut
+
+class TestPlan:
+    """
+    Everything needed to make a test from a configuration, worked out once per
+    batch so that making each test only has to sample and walk the plan.
+    A plan is picklable, so it can be handed to worker processes.
     
-    #read in the question files
-    for questionSet in testConfig["question sets"]:
-        for questionFile in questionSet["question files"]:
-            #first, extract the raw tex from the files
-            questionPath = pathlib.Path(questionFile["file path"])
-            rawTex = ""
-            try:
-                with open(questionPath, "r") as fin:
-                    rawTex = fin.read()
-            except IOError:
-                print("ERROR: Problem reading question file at " + str(questionPath) + ".")
-                waitAndExit(1)
+    Each entry of sets is a dictionary with:
+        "number of questions" = how many questions to choose from the set
+        "question tex", "answer tex" = every question in the set, in file order
+        "file of question" = array giving the index of the file each question came from
+        "file starts" = index of the first question of each file, plus the total at the end
+        "instructions tex" = for each file, the instructions and start of the questions environment
+        "test fragments", "answer key fragments" = every question in the set already rendered as it appears
+                                                  on the test and answer key, item and answer box included
+        "question ids" = the ID of every question in the set
+        "question positions" = dictionary from the ID of each question in the set to its first index in the set
+        "distinct questions" = array of the first index of each different question in the set, the only ones chosen
+        "shares questions" = whether the set has a question twice, or a question that is also in another set
+    
+    No question is ever on a test twice, even if it is in several files or
+    several sets.  questionIndex is the question bank's questions, mapping each
+    question ID to where the question came from.
+    
+    With a CompactQuestionBank, the lists of tex and fragments are instead
+    ChainedSequences that only read a question from its file when it is used.
+    """
+    
+    def __init__(self, config, questionBank, testHeader, answerHeader):
+        """
+        config = the configuration
+        questionBank = QuestionBank or CompactQuestionBank with all of the configuration's question files loaded
+        testHeader = the LaTeX header for tests
+        answerHeader = the LaTeX header for answer keys
+        """
+        self.testHeader = testHeader
+        self.answerHeader = answerHeader
+        self.pageBreaks = frozenset(config["page breaks after questions"])
+        self.sets = []
+        for questionSet in config["question sets"]:
+            plannedSet = {
+                "number of questions":questionSet["number of questions"],
+                "question tex":[],
+                "answer tex":[],
+                "file of question":array.array("i"),
+                "file starts":[],
+                "instructions tex":[],
+                "test fragments":[],
+                "answer key fragments":[],
+                "question ids":[]
+            }
+            questionCount = 0
+            for fileIndex, questionFile in enumerate(questionSet["question files"]):
+                questions = questionBank.get(questionFile["file path"])
+                testFragments, answerFragments = questionBank.renderFragments(questionFile["file path"])
+                
+                #each file's lists are joined into one for the whole set below
+                plannedSet["file starts"].append(questionCount)
+                plannedSet["question tex"].append(questions["question tex"])
+                plannedSet["answer tex"].append(questions["answer tex"])
+                plannedSet["test fragments"].append(testFragments)
+                plannedSet["answer key fragments"].append(answerFragments)
+                plannedSet["question ids"].extend(questions["question ids"])
+                plannedSet["file of question"].extend([fileIndex] * len(questions["question tex"]))
+                plannedSet["instructions tex"].append(TEX_INSTRUCTION_START + questionFile["instructions"] + TEX_INSTRUCTION_END + "\n" + TEX_BEGIN_QUESTIONS + "\n")
+                questionCount += len(questions["question tex"])
+            plannedSet["file starts"].append(questionCount)
+            
+            #a compact bank's text is only read for the questions actually used, so it is left where it is rather than copied
+            for textKey in ("question tex", "answer tex", "test fragments", "answer key fragments"):
+                if questionBank.lazy:
+                    plannedSet[textKey] = ChainedSequence(plannedSet[textKey])
+                else:
+                    plannedSet[textKey] = list(itertools.chain.from_iterable(plannedSet[textKey]))
+            self.sets.append(plannedSet)
+        
+        #only sets with a question in common need checking for repeats when sampling, the rest can sample freely
+        self.questionIndex = questionBank.questions
+        self.sharedQuestionSets = None #worked out by sampleFeasible the first time it is needed
+        setsOfQuestion = {}
+        for plannedSet in self.sets:
+            questionPositions = {}
+            for questionIndex, qid in enumerate(plannedSet["question ids"]):
+                questionPositions.setdefault(qid, questionIndex)
+            plannedSet["question positions"] = questionPositions
+            plannedSet["distinct questions"] = array.array("i", questionPositions.values())
+            for qid in questionPositions:
+                setsOfQuestion[qid] = setsOfQuestion.get(qid, 0) + 1
+        for plannedSet in self.sets:
+            plannedSet["shares questions"] = len(plannedSet["distinct questions"]) < len(plannedSet["question ids"]) or any(setsOfQuestion[qid] > 1 for qid in plannedSet["question positions"])
+        
+        #fingerprints of everything a test depends on besides its seed, so a recorded version can be checked before it is rebuilt
+        configDescription = {
+            "headers":[testHeader, answerHeader],
+            "page breaks":sorted(self.pageBreaks),
+            "sets":[[plannedSet["number of questions"], plannedSet["instructions tex"]] for plannedSet in self.sets]
+        }
+        bankDescription = [[plannedSet["file starts"], plannedSet["question tex"], plannedSet["answer tex"]] for plannedSet in self.sets]
+        if any(plannedSet["shares questions"] for plannedSet in self.sets):
+            configDescription["no repeated questions"] = True #versions recorded before repeats were avoided can't be made again
+        self.configHash = hashlib.sha256(json.dumps(configDescription).encode("utf-8")).hexdigest()[:16]
+        bankHasher = hashlib.sha256()
+        if questionBank.lazy:
+            updateJsonHash(bankHasher, bankDescription)
+        else:
+            bankHasher.update(json.dumps(bankDescription).encode("utf-8"))
+        self.bankHash = bankHasher.hexdigest()[:16]
+    
+    def sample(self, rng):
+        """
+        Randomly chooses the questions for one test.  Returns, for each set, a list
+        of question indices into the set, grouped by the file they came from.
         
-            #now remove whitespace and try to decide what lines are answers and what are questions
-            questionTex = []
-            answerTex = []
-            texLines = rawTex.splitlines()
-            for i in range(0, len(texLines)):
-                #get the question, skipping empty lines or commented lines
-                cleanLine = texLines[i].strip()
-                if cleanLine == "" or cleanLine[0] == "%":
+        rng = the random.Random to sample with
+        """
+        #an earlier set can take all of a later set's questions, so try again when that happens
+        for attempt in range(0, SAMPLE_ATTEMPTS):
+            chosenQuestionsBySet = []
+            usedIds = set()
+            for plannedSet in self.sets:
+                if plannedSet["shares questions"]:
+                    chosenQuestionsBySet.append(self.sampleDistinct(plannedSet, usedIds, rng))
+                else:
+                    chosenQuestionsBySet.append(rng.sample(range(len(plannedSet["question tex"])), plannedSet["number of questions"]))
+            if self.isComplete(chosenQuestionsBySet):
+                break
+        else:
+            self.sampleFeasible(chosenQuestionsBySet, rng)
+        
+        #sort based on what file they came from - makes it easier to group when printing instructions
+        for plannedSet, chosenQuestions in zip(self.sets, chosenQuestionsBySet):
+            chosenQuestions.extend(self.fillRepeats(plannedSet, chosenQuestions))
+            chosenQuestions.sort(key=plannedSet["file of question"].__getitem__)
+        return chosenQuestionsBySet
+    
+    def sampleFeasible(self, chosenQuestionsBySet, rng, questionOrder=None):
+        """
+        Chooses the questions again for the sets that share questions, for when
+        random tries keep ending up with a set short because the sets only just
+        have enough between them.  A randomized assignQuestionGroups says how
+        many questions each set can take from each group of questions in the same
+        sets, and each set then goes through its questions in a random order,
+        taking one whenever that still leaves the other sets enough.  This always
+        succeeds for a configuration that passed validation; otherwise it prints a
+        warning and leaves the sets short.  Changes chosenQuestionsBySet in place.
+        
+        chosenQuestionsBySet = the questions chosen for each set; the sets not sharing questions are kept
+        rng = the random.Random to choose with
+        questionOrder = function taking a set index and a list of its question indices and returning them
+                        in the order to try them, or None for a random order
+        """
+        if self.sharedQuestionSets is None:
+            sharedQuestionSets = {}
+            for setIndex, plannedSet in enumerate(self.sets):
+                if plannedSet["shares questions"]:
+                    for qid in plannedSet["question positions"]:
+                        sharedQuestionSets[qid] = sharedQuestionSets.get(qid, 0) | (1 << setIndex)
+            self.sharedQuestionSets = sharedQuestionSets
+        groupSizes = collections.Counter(self.sharedQuestionSets.values())
+        neededBySet = [plannedSet["number of questions"] if plannedSet["shares questions"] else 0 for plannedSet in self.sets]
+        allotted, overcommitted = assignQuestionGroups(groupSizes, neededBySet, rng)
+        if overcommitted:
+            print("WARNING: could not choose questions for a test without repeating one, check that sets sharing questions have enough between them.")
+        unallotted = dict(groupSizes)
+        for (setIndex, setMask), count in allotted.items():
+            unallotted[setMask] -= count
+        
+        usedIds = set()
+        for setIndex, plannedSet in enumerate(self.sets):
+            if not plannedSet["shares questions"]:
+                continue
+            questionIds = plannedSet["question ids"]
+            distinctQuestions = list(plannedSet["distinct questions"])
+            chosenQuestions = []
+            for questionIndex in questionOrder(setIndex, distinctQuestions) if questionOrder is not None else rng.sample(distinctQuestions, len(distinctQuestions)):
+                if len(chosenQuestions) >= neededBySet[setIndex]:
+                    break
+                qid = questionIds[questionIndex]
+                if qid in usedIds:
                     continue
-                questionTex.append(cleanLine)
                 
-                #check if the next line is an answer, skipping empty lines or lines not starting with "%%"
-                if i+1 >= len(texLines):
-                    continue #well, break actually
-                cleanLine = texLines[i+1].strip()
-                if cleanLine == "" or cleanLine[0:2] != "%%":
-                    answerTex.append("")
+                #a question from a group the set was allotted is always safe, and so is one nobody was allotted if the set gives back one of its own
+                setMask = self.sharedQuestionSets[qid]
+                if allotted.get((setIndex, setMask), 0) > 0:
+                    allotted[(setIndex, setMask)] -= 1
+                elif unallotted[setMask] > 0:
+                    givenBack = next((key for key, count in allotted.items() if key[0] == setIndex and count > 0), None)
+                    if givenBack is None:
+                        continue
+                    unallotted[setMask] -= 1
+                    allotted[givenBack] -= 1
+                    unallotted[givenBack[1]] += 1
                 else:
-                    answerTex.append(cleanLine[2:])
-                    i+=1
-                #TODO - improve comment symbol removal?
-            questionFile["question tex"] = questionTex
-            questionFile["answer tex"] = answerTex
-            
-        #verify that there is enough questions to make the test, error and exit if not
-        if questionSet["number of questions"] > sum([len(qf["question tex"]) for qf in questionSet["question files"]]):
-            print("ERROR: Insufficient number of questions in")
-            for questionFile in questionSet["question files"]:
-                print("\t" + questionFile["file path"])
-            print("Expected at least " + str(questionSet["number of questions"]) + " questions total.")
-            waitAndExit(1)
-
-    for testCreatedCount in range(0,numberOfTests):
-        #construct the test - this could of course be merged with the above loop, but the performance gain is negligible compared to the readability of separating data loading/validation and test construction
-        totalQuestionsWritten = 0
-        testTex = testHeader + "\n"
-        answerTex = answerHeader + "\n"
-        for questionSet in testConfig["question sets"]:
-            #throw all the questions in a big list to make random sampling from multiple files easier
-            taggedQuestions = []
-            for i in range(0, len(questionSet["question files"])):
-                for j in range(0, len(questionSet["question files"][i]["question tex"])):
-                    taggedQuestions.append((i, questionSet["question files"][i]["question tex"][j], questionSet["question files"][i]["answer tex"][j]))
-            
-            #sample the questions and then sort based on what file they came from - makes it easier to group when printing instructions
-            chosenQuestions = random.sample(taggedQuestions, questionSet["number of questions"])
-            chosenQuestions.sort(key=lambda q: q[0])
-            
-            #loop over each question file, and print instructions and questions chosen from that file
-            startIndex = 0
-            for j in range(0, len(questionSet["question files"])):
-                environmentTexWritten = False
-                for i in range(startIndex, len(chosenQuestions)):
-                    fileIndex, questionTex, questionAnswerTex = chosenQuestions[i]
-                    
-                    #check that this question belongs to this file; if not, break so we can move on to the next set, which has different instructions
-                    if fileIndex != j:
-                        startIndex = i
+                    continue
+                chosenQuestions.append(questionIndex)
+                usedIds.add(qid)
+            chosenQuestionsBySet[setIndex] = chosenQuestions
+    
+    @staticmethod
+    def sampleDistinct(plannedSet, usedIds, rng):
+        """
+        Randomly chooses the questions for a set that shares questions, skipping
+        any question whose ID is in usedIds and adding the chosen IDs to it.
+        Returns fewer questions than the set needs if there aren't enough left.
+        
+        plannedSet = the set to choose from
+        usedIds = set of the IDs of questions already on the test
+        rng = the random.Random to sample with
+        """
+        questionIds = plannedSet["question ids"]
+        distinctQuestions = plannedSet["distinct questions"]
+        needed = plannedSet["number of questions"]
+        chosenQuestions = [questionIndex for questionIndex in rng.sample(distinctQuestions, needed) if questionIds[questionIndex] not in usedIds]
+        if len(chosenQuestions) < needed:
+            #replace the ones already on the test by going through the rest of the set in a random order
+            chosenSet = set(chosenQuestions)
+            for questionIndex in rng.sample(distinctQuestions, len(distinctQuestions)):
+                if questionIndex not in chosenSet and questionIds[questionIndex] not in usedIds:
+                    chosenQuestions.append(questionIndex)
+                    if len(chosenQuestions) == needed:
                         break
+        usedIds.update(questionIds[questionIndex] for questionIndex in chosenQuestions)
+        return chosenQuestions
+    
+    def isComplete(self, chosenQuestionsBySet):
+        """
+        Whether every set got all of its questions without repeating any.
+        """
+        return all(len(chosenQuestions) == plannedSet["number of questions"] for plannedSet, chosenQuestions in zip(self.sets, chosenQuestionsBySet))
+    
+    @staticmethod
+    def fillRepeats(plannedSet, chosenQuestions):
+        """
+        Returns however many more of the set's questions it needs that aren't in
+        chosenQuestions, for when the sets sharing its questions don't have enough
+        between them and some have to be on the test twice.  Validation rejects
+        such configurations, so this only happens when sampleFeasible couldn't help.
+        """
+        needed = plannedSet["number of questions"] - len(chosenQuestions)
+        if needed <= 0:
+            return []
+        chosenSet = set(chosenQuestions)
+        return [questionIndex for questionIndex in plannedSet["distinct questions"] if questionIndex not in chosenSet][:needed]
+    
+    def selectionIds(self, chosenQuestionsBySet):
+        """
+        Returns the IDs of the questions chosen for each set, for recording a selection.
+        
+        chosenQuestionsBySet = the questions chosen for each set, as returned by sample
+        """
+        return [[plannedSet["question ids"][questionIndex] for questionIndex in chosenQuestions] for plannedSet, chosenQuestions in zip(self.sets, chosenQuestionsBySet)]
+    
+    def selectionFromIds(self, selection):
+        """
+        Turns a selection recorded by selectionIds back into what sample returns.
+        Selections recorded as question indices are returned as they are.
+        
+        selection = list of the chosen question IDs for each set
+        """
+        return [[plannedSet["question positions"][qid] if isinstance(qid, str) else qid for qid in chosenIds] for plannedSet, chosenIds in zip(self.sets, selection)]
+
+def loadSelectionHistory(testPlan, outputDir, avoidVersions):
+    """
+    Returns the questions chosen for earlier versions recorded in the output
+    directory's manifest, as lists like TestPlan.sample returns.  Versions that
+    aren't in the manifest, or were made from a different configuration or
+    different question files, are skipped with a warning.
+    
+    testPlan = the TestPlan the new tests will be made from
+    outputDir = the output directory holding the manifest
+    avoidVersions = list of version numbers, or AVOID_ALL_VERSIONS for every version in the manifest
+    """
+    records = readManifest(outputDir)
+    if avoidVersions == AVOID_ALL_VERSIONS:
+        avoidVersions = sorted(records)
+    
+    history = []
+    skippedVersions = []
+    for testNumber in avoidVersions:
+        record = records.get(testNumber)
+        if record is None or record["config hash"] != testPlan.configHash or record["question bank hash"] != testPlan.bankHash:
+            skippedVersions.append(testNumber)
+        elif "selection" in record:
+            history.append(testPlan.selectionFromIds(record["selection"]))
+        else:
+            history.append(testPlan.sample(random.Random(record["seed"])))
+    if skippedVersions:
+        print("WARNING: versions " + ", ".join(str(testNumber) for testNumber in skippedVersions) + " are not in the manifest or were made from a different configuration or question files, so they weren't avoided.")
+    return history
+
+class UsageTracker:
+    """
+    Chooses questions so that tests overlap as little as possible, by always
+    choosing the least used questions in each set, with ties broken at random.
+    
+    Each set's questions are kept in buckets by how many times they have been
+    used, so choosing a test only touches as many questions as it needs rather
+    than every question in the set.  Exact repeats of a whole test's selection
+    are also remembered and avoided whenever the sets are big enough to allow it.
+    """
+    
+    def __init__(self, testPlan):
+        """
+        testPlan = the TestPlan to choose questions from
+        """
+        self.testPlan = testPlan
+        self.usageCounts = []
+        self.buckets = []
+        self.bucketPositions = []
+        for plannedSet in testPlan.sets:
+            #only the first copy of a repeated question is ever chosen, so only those go in the buckets
+            numberOfQuestions = len(plannedSet["question tex"])
+            bucketPositions = array.array("i", [0]) * numberOfQuestions
+            for position, questionIndex in enumerate(plannedSet["distinct questions"]):
+                bucketPositions[questionIndex] = position
+            self.usageCounts.append(array.array("i", [0]) * numberOfQuestions)
+            self.buckets.append({0:list(plannedSet["distinct questions"])})
+            self.bucketPositions.append(bucketPositions)
+        self.seenSelections = set()
+        self.warnedAboutRepeats = False
+    
+    def record(self, chosenQuestionsBySet):
+        """
+        Counts the questions of a test as used.
+        
+        chosenQuestionsBySet = the questions chosen for each set, like TestPlan.sample returns
+        """
+        #a version chosen before repeats were avoided may have used a later copy of a question
+        plannedSets = self.testPlan.sets
+        chosenQuestionsBySet = [[plannedSet["question positions"][plannedSet["question ids"][questionIndex]] for questionIndex in chosenQuestions] for plannedSet, chosenQuestions in zip(plannedSets, chosenQuestionsBySet)]
+        self.seenSelections.add(self.selectionKey(chosenQuestionsBySet))
+        for setIndex, chosenQuestions in enumerate(chosenQuestionsBySet):
+            for questionIndex in set(chosenQuestions):
+                self.moveToBucket(setIndex, questionIndex, self.usageCounts[setIndex][questionIndex] + 1)
+    
+    def sample(self, rng):
+        """
+        Chooses the questions for one test and counts them as used.  Returns the
+        same as TestPlan.sample.
+        
+        rng = the random.Random to break ties with
+        """
+        #ties are broken differently on each try, in case an earlier set took all of a later set's least used questions
+        for attempt in range(0, SAMPLE_ATTEMPTS):
+            usedIds = set()
+            chosenQuestionsBySet = [self.chooseLeastUsed(setIndex, usedIds, rng) for setIndex in range(0, len(self.testPlan.sets))]
+            if self.testPlan.isComplete(chosenQuestionsBySet):
+                break
+        else:
+            #the least used questions are tried first, ties broken randomly
+            self.testPlan.sampleFeasible(chosenQuestionsBySet, rng, questionOrder=lambda setIndex, questions: sorted(questions, key=lambda questionIndex: (self.usageCounts[setIndex][questionIndex], rng.random())))
+        for plannedSet, chosenQuestions in zip(self.testPlan.sets, chosenQuestionsBySet):
+            chosenQuestions.extend(TestPlan.fillRepeats(plannedSet, chosenQuestions))
+        
+        if self.selectionKey(chosenQuestionsBySet) in self.seenSelections:
+            chosenQuestionsBySet = self.findUnseenSelection(chosenQuestionsBySet)
+        
+        #sort based on what file they came from - makes it easier to group when printing instructions
+        for plannedSet, chosenQuestions in zip(self.testPlan.sets, chosenQuestionsBySet):
+            chosenQuestions.sort(key=plannedSet["file of question"].__getitem__)
+        self.record(chosenQuestionsBySet)
+        return chosenQuestionsBySet
+    
+    def chooseLeastUsed(self, setIndex, usedIds, rng):
+        """
+        Chooses the least used questions of a set, skipping any question whose ID
+        is in usedIds if the set shares questions, and adding the chosen IDs to it.
+        Returns fewer questions than the set needs if there aren't enough left.
+        
+        setIndex = the index of the set to choose from
+        usedIds = set of the IDs of questions already on the test
+        rng = the random.Random to break ties with
+        """
+        #always choosing the least used keeps the counts close together, so there are only ever a few buckets
+        plannedSet = self.testPlan.sets[setIndex]
+        questionIds = plannedSet["question ids"]
+        chosenQuestions = []
+        needed = plannedSet["number of questions"]
+        for usageCount in sorted(self.buckets[setIndex]):
+            bucket = self.buckets[setIndex][usageCount]
+            if plannedSet["shares questions"]:
+                bucket = [questionIndex for questionIndex in bucket if questionIds[questionIndex] not in usedIds]
+            if len(bucket) <= needed:
+                chosenQuestions.extend(bucket)
+                needed -= len(bucket)
+            else:
+                chosenQuestions.extend(rng.sample(bucket, needed))
+                needed = 0
+            if needed == 0:
+                break
+        if plannedSet["shares questions"]:
+            usedIds.update(questionIds[questionIndex] for questionIndex in chosenQuestions)
+        return chosenQuestions
+    
+    def findUnseenSelection(self, chosenQuestionsBySet):
+        """
+        Swaps a single question in the selection for an unchosen one, trying the least
+        used replacements first, until the selection is one that hasn't been seen.
+        Returns the selection unchanged, with a warning, if there is no such swap.
+        """
+        for setIndex, chosenQuestions in enumerate(chosenQuestionsBySet):
+            plannedSet = self.testPlan.sets[setIndex]
+            usageCounts = self.usageCounts[setIndex]
+            chosenSet = set(chosenQuestions)
+            takenIds = set()
+            if plannedSet["shares questions"]:
+                takenIds = {otherSet["question ids"][questionIndex] for otherIndex, (otherSet, otherQuestions) in enumerate(zip(self.testPlan.sets, chosenQuestionsBySet)) if otherIndex != setIndex for questionIndex in otherQuestions}
+            replacements = sorted((questionIndex for questionIndex in plannedSet["distinct questions"] if questionIndex not in chosenSet and plannedSet["question ids"][questionIndex] not in takenIds), key=usageCounts.__getitem__)
+            for replacement in replacements:
+                for position in sorted(range(0, len(chosenQuestions)), key=lambda i: -usageCounts[chosenQuestions[i]]):
+                    candidate = [list(questions) for questions in chosenQuestionsBySet]
+                    candidate[setIndex][position] = replacement
+                    if self.selectionKey(candidate) not in self.seenSelections:
+                        return candidate
+        if not self.warnedAboutRepeats:
+            print("WARNING: every possible selection of questions has already been used, so some tests will be repeats.")
+            self.warnedAboutRepeats = True
+        return chosenQuestionsBySet
+    
+    def moveToBucket(self, setIndex, questionIndex, usageCount):
+        """
+        Changes the usage count of a question, moving it to the matching bucket.
+        """
+        buckets = self.buckets[setIndex]
+        positions = self.bucketPositions[setIndex]
+        
+        #swap the question with the last in its bucket, so it can be removed without shifting the rest
+        oldBucket = buckets[self.usageCounts[setIndex][questionIndex]]
+        lastQuestion = oldBucket[-1]
+        oldBucket[positions[questionIndex]] = lastQuestion
+        positions[lastQuestion] = positions[questionIndex]
+        oldBucket.pop()
+        if not oldBucket:
+            del buckets[self.usageCounts[setIndex][questionIndex]]
+        
+        newBucket = buckets.setdefault(usageCount, [])
+        positions[questionIndex] = len(newBucket)
+        newBucket.append(questionIndex)
+        self.usageCounts[setIndex][questionIndex] = usageCount
+    
+    @staticmethod
+    def selectionKey(chosenQuestionsBySet):
+        """
+        A hashable key for a test's selection that ignores the order of the questions.
+        """
+        return tuple(frozenset(chosenQuestions) for chosenQuestions in chosenQuestionsBySet)
+
+def renderQuestionFragments(questionTex, answerTex):
+    """
+    Renders questions as they appear on a test and on an answer key.  Returns
+    a tuple of two lists, (test fragments, answer key fragments).
+    
+    questionTex = list of the questions' tex
+    answerTex = list of the answers' tex, in the same order
+    """
+    testFragments = []
+    answerFragments = []
+    for questionText, answerText in zip(questionTex, answerTex):
+        #add the question and answer box
+        itemTex = TEX_SPACING + TEX_ITEM + questionText + "\n"
+        testFragments.append(itemTex + TEX_SPACING + TEX_ANSWER_BOX_EMPTY + "\n")
+        answerFragments.append(
+            itemTex + TEX_SPACING + TEX_ANSWER_BOX_FULL_START
+            + "\n" + TEX_SPACING*2 + answerText + "\n" #we do a bad job of sanitizing comments, so sometimes putting things on the same line broke stuff
+            + TEX_SPACING + TEX_ANSWER_BOX_FULL_END + "\n"
+        )
+    return testFragments, answerFragments
+
+def writeTestBody(testPlan, chosenQuestionsBySet, testOut, answerOut):
+    """
+    Writes the questions of one test and its answer key, everything between the
+    header and the end of the document.  Every question is already rendered in
+    the plan, so this only strings together those fragments and writes them out.
+    
+    testPlan = the TestPlan the questions were chosen from
+    chosenQuestionsBySet = the questions chosen for each set, as returned by TestPlan.sample
+    testOut = file to write the test to
+    answerOut = file to write the answer key to
+    """
+    testChunks = []
+    answerChunks = []
+    totalQuestionsWritten = 0
+    for plannedSet, chosenQuestions in zip(testPlan.sets, chosenQuestionsBySet):
+        #questions are grouped by file, so the instructions only need writing when the file changes
+        currentFile = None
+        for questionIndex in chosenQuestions:
+            fileIndex = plannedSet["file of question"][questionIndex]
+            if fileIndex != currentFile:
+                if currentFile is not None:
+                    testChunks.append(TEX_END_QUESTIONS_BLOCK)
+                    answerChunks.append(TEX_END_QUESTIONS_BLOCK)
+                testChunks.append(plannedSet["instructions tex"][fileIndex])
+                answerChunks.append(plannedSet["instructions tex"][fileIndex])
+                currentFile = fileIndex
             
-                    #add the instructions and environment "begin" if it hasn't already been
-                    if not environmentTexWritten:
-                        testTex += TEX_INSTRUCTION_START
-                        testTex += questionSet["question files"][j]["instructions"]
-                        testTex += TEX_INSTRUCTION_END + "\n"
-                        testTex += TEX_BEGIN_QUESTIONS + "\n"
-                        
-                        answerTex += TEX_INSTRUCTION_START
-                        answerTex += questionSet["question files"][j]["instructions"]
-                        answerTex += TEX_INSTRUCTION_END + "\n"
-                        answerTex += TEX_BEGIN_QUESTIONS + "\n"
-                        
-                        environmentTexWritten = True
-                    
-                    #add the question and answer box
-                    testTex += TEX_SPACING + TEX_ITEM
-                    testTex += questionTex + "\n"
-                    testTex += TEX_SPACING + TEX_ANSWER_BOX_EMPTY + "\n"
-                    
-                    answerTex += TEX_SPACING + TEX_ITEM
-                    answerTex += questionTex + "\n"
-                    answerTex += TEX_SPACING + TEX_ANSWER_BOX_FULL_START
-                    answerTex += "\n" + TEX_SPACING*2 + questionAnswerTex + "\n" #we do a bad job of sanitizing comments, so sometimes putting things on the same line broke stuff
-                    answerTex += TEX_SPACING + TEX_ANSWER_BOX_FULL_END + "\n"
-                    
-                    #check to add the page breaks
-                    totalQuestionsWritten += 1
-                    if totalQuestionsWritten in testConfig["page breaks after questions"]:
-                        testTex += TEX_SPACING + TEX_NEWPAGE + "\n"
-                        answerTex += TEX_SPACING + TEX_NEWPAGE + "\n"
+            testChunks.append(plannedSet["test fragments"][questionIndex])
+            answerChunks.append(plannedSet["answer key fragments"][questionIndex])
             
-                #if we actually added questions from this file, add the end of the questions environment
-                if environmentTexWritten:
-                    testTex += TEX_END_QUESTIONS + "\n\n"
-                    answerTex += TEX_END_QUESTIONS + "\n\n"
-                    
-        testTex += TEX_END_DOCUMENT
-        answerTex += TEX_END_DOCUMENT
+            #check to add the page breaks
+            totalQuestionsWritten += 1
+            if totalQuestionsWritten in testPlan.pageBreaks:
+                testChunks.append(TEX_PAGE_BREAK_LINE)
+                answerChunks.append(TEX_PAGE_BREAK_LINE)
+        
+        #close the questions environment for the last file used
+        if currentFile is not None:
+            testChunks.append(TEX_END_QUESTIONS_BLOCK)
+            answerChunks.append(TEX_END_QUESTIONS_BLOCK)
+    
+    testOut.write("".join(testChunks))
+    answerOut.write("".join(answerChunks))
+
+def compileTests(testPlan, outputDir, texNames, compileSettings):
+    """
+    Compiles tests and answer keys to PDF by running a LaTeX command on each, over
+    a pool of workers.  Files whose contents haven't changed since they were last
+    compiled successfully are skipped.  If the command uses {format}, the headers
+    are first compiled into a format file that every compile reuses, so the
+    preamble isn't processed again for each file.  Failures are reported but
+    don't stop the other files from compiling.
+    
+    testPlan = the TestPlan the tests were made from, for its headers
+    outputDir = the output directory holding the tests
+    texNames = names of the .tex files in the output directory to compile
+    compileSettings = dictionary of settings, all optional:
+        "command" = command to compile a file, with {file} for the .tex file name and {format} for the format name (default LATEX_COMMAND)
+        "format command" = command to build a format, with {file} for the header's .tex file name and {format} for the format name (default LATEX_FORMAT_COMMAND)
+        "workers" = number of compiles to run at once (default the number of CPUs)
+    
+    Returns the list of file names that failed to compile.
+    """
+    outputDir = pathlib.Path(outputDir)
+    command = compileSettings.get("command") or LATEX_COMMAND
+    formatCommand = compileSettings.get("format command") or LATEX_FORMAT_COMMAND
+    workers = compileSettings.get("workers") or os.cpu_count() or 1
+    
+    #tests and answer keys may have different headers, so they may need different formats
+    texFiles = [(texName, testPlan.answerHeader if texName.endswith(ANSWER_KEY_FILE_SUFFIX) else testPlan.testHeader) for texName in texNames]
+    formatNames = {}
+    if "{format}" in command:
+        for header in set(header for texName, header in texFiles):
+            formatName = buildLatexFormat(outputDir, header, formatCommand)
+            if formatName is None:
+                return [texName for texName, texHeader in texFiles if texHeader == header]
+            formatNames[header] = formatName
+    
+    #work out what actually needs compiling
+    cachePath = outputDir / COMPILE_CACHE_FILE_NAME
+    try:
+        with open(cachePath, "r") as fin:
+            compileCache = json.load(fin)
+    except (IOError, ValueError):
+        compileCache = {}
+    toCompile = []
+    for texName, header in texFiles:
+        formatName = formatNames.get(header, "")
+        hasher = hashlib.sha256((command + "\n" + formatName + "\n").encode("utf-8"))
+        hasher.update((outputDir / texName).read_bytes())
+        contentHash = hasher.hexdigest()
+        if compileCache.get(texName) == contentHash and (outputDir / texName).with_suffix(".pdf").exists():
+            continue
+        toCompile.append((texName, formatName, contentHash))
+    
+    failedFiles = []
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        results = pool.map(lambda job: runLatexCommand(outputDir, command, job[0], job[1]), toCompile)
+        for (texName, formatName, contentHash), (succeeded, output) in zip(toCompile, results):
+            if succeeded:
+                compileCache[texName] = contentHash
+                print("Compiled '" + texName + "'")
+            else:
+                compileCache.pop(texName, None)
+                failedFiles.append(texName)
+                print("ERROR: could not compile '" + texName + "':")
+                print(output[-2000:])
+    print("Compiled " + str(len(toCompile) - len(failedFiles)) + " files, " + str(len(texFiles) - len(toCompile)) + " were unchanged, " + str(len(failedFiles)) + " failed.")
+    
+    #a concurrent run never sees half a cache
+    try:
+        replaceFile(cachePath, json.dumps(compileCache))
+    except IOError:
+        print("WARNING: could not write the compile cache at " + str(cachePath))
+    return failedFiles
+
+def buildLatexFormat(outputDir, header, formatCommand):
+    """
+    Compiles a header into a LaTeX format file in the output directory, unless
+    that header's format has already been built.  Returns the format name, or None
+    if building it failed.
+    
+    outputDir = the output directory
+    header = the LaTeX header the format is built from
+    formatCommand = the command to build the format with
+    """
+    formatName = "preamble_" + hashlib.sha256((formatCommand + "\n" + header).encode("utf-8")).hexdigest()[:16]
+    if (outputDir / (formatName + ".fmt")).exists():
+        return formatName
+    (outputDir / (formatName + ".tex")).write_text(header)
+    succeeded, output = runLatexCommand(outputDir, formatCommand, formatName + ".tex", formatName)
+    if not succeeded:
+        print("ERROR: could not build the LaTeX format from the header:")
+        print(output[-2000:])
+        return None
+    return formatName
+
+def runLatexCommand(outputDir, command, texName, formatName):
+    """
+    Runs a LaTeX command in the output directory.  Returns (True if it succeeded, its output).
+    
+    outputDir = the directory to run the command in
+    command = the command, with {file} and {format} filled in for each argument
+    texName = the name of the .tex file
+    formatName = the name of the format
+    """
+    arguments = [argument.replace("{file}", texName).replace("{format}", formatName) for argument in shlex.split(command)]
+    try:
+        result = subprocess.run(arguments, cwd=outputDir, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        return False, "could not run " + arguments[0] + ": " + str(e)
+    return result.returncode == 0, result.stdout.decode("utf-8", "replace")
 
-        #make the directory for the tests if it doesn't already exist
+class GenerationService:
+    """
+    Keeps a configuration and its question files loaded, so that tests can be
+    made on request without reading and parsing everything each time.  Requests
+    can be served from several threads at once: each one uses whichever plan was
+    loaded when it started, and a reload swaps in a new plan without disturbing
+    requests already running.  Version numbers are reserved the same way as for
+    separate runs, so the service can share an output directory with them.
+    """
+    
+    def __init__(self, configPath, outputDir, cachePath=QUESTION_CACHE_FILE_PATH, workers=1, compileSettings=None):
+        """
+        configPath = path to the configuration file
+        outputDir = directory to write tests into, unless a request says otherwise
+        cachePath = path of the parsed question file cache, or None to not use one
+        workers = number of processes to make each request's tests with
+        compileSettings = settings for compileTests to compile the tests to PDF, or None to leave them as .tex
+        """
+        self.configPath = configPath
+        self.outputDir = pathlib.Path(outputDir)
+        self.workers = workers
+        self.compileSettings = compileSettings
+        self.questionBank = QuestionBank(cachePath)
+        self.reloadLock = threading.Lock()
+        self.loaded = None #(config, test plan, time loaded), replaced all at once so requests always see a matching set
+    
+    def load(self):
+        """
+        Reads the configuration, headers and any question files that changed since
+        they were last read.  Exits with an error message if anything is wrong,
+        leaving what was loaded before in place.
+        """
+        with self.reloadLock:
+            config = loadConfig(self.configPath)
+            self.questionBank.refresh()
+            testPlan = loadTestPlan(config, questionBank=self.questionBank)
+            self.loaded = (config, testPlan, time.time())
+    
+    def reload(self):
+        """
+        load() for a request.  Returns (HTTP status, response).
+        """
         try:
-            OUTPUT_DIR_PATH.mkdir(exist_ok=True)
-        except FileExistsError:
-            print("ERROR: problem with the output directory at: " + str(OUTPUT_DIR_PATH))
-            print("Check permissions or that there isn't a file with the same name")
-            waitAndExit(1)
+            self.load()
+        except SystemExit:
+            return 500, {"error":"could not reload, see the service's output for why; still using what was loaded before"}
+        return 200, self.status()
+    
+    def status(self):
+        """
+        Describes what is loaded, as a dictionary.
+        """
+        config, testPlan, loadedAt = self.loaded
+        return {
+            "config":str(self.configPath),
+            "loaded at":time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(loadedAt)),
+            "question files":len(self.questionBank.files),
+            "questions":len(testPlan.questionIndex),
+            "config hash":testPlan.configHash,
+            "question bank hash":testPlan.bankHash
+        }
+    
+    def makeTests(self, request):
+        """
+        Makes tests for a request.  Returns (HTTP status, response).  Raises
+        ValueError if the request doesn't make sense.
+        
+        request = dictionary with "tests", the number of tests to make, and optionally
+                  "seed", "output dir" (relative to the service's output directory),
+                  "output mode", "manifest only", and "avoid" (a list of version numbers,
+                  AVOID_ALL_VERSIONS, or "none"), which work like the command line options
+        """
+        #JSON true and false would otherwise pass for the numbers 1 and 0
+        numberOfTests = request.get("tests")
+        if not isinstance(numberOfTests, int) or isinstance(numberOfTests, bool) or numberOfTests < 1:
+            raise ValueError("\"tests\" must be a number of at least 1")
+        seed = request.get("seed")
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            raise ValueError("\"seed\" must be a number")
+        outputMode = request.get("output mode", OUTPUT_MODE_FILES)
+        if outputMode not in (OUTPUT_MODE_FILES, OUTPUT_MODE_COMBINED, OUTPUT_MODE_ARCHIVE):
+            raise ValueError("\"output mode\" must be '" + OUTPUT_MODE_FILES + "', '" + OUTPUT_MODE_COMBINED + "' or '" + OUTPUT_MODE_ARCHIVE + "'")
+        avoidVersions = request.get("avoid")
+        if avoidVersions == "none":
+            avoidVersions = []
+        elif avoidVersions is not None and avoidVersions != AVOID_ALL_VERSIONS and not (isinstance(avoidVersions, list) and all(isinstance(testNumber, int) and not isinstance(testNumber, bool) for testNumber in avoidVersions)):
+            raise ValueError("\"avoid\" must be '" + AVOID_ALL_VERSIONS + "', 'none' or a list of version numbers")
+        
+        #anyone who can reach the service can send a request, so it never writes outside its own output directory
+        outputDir = request.get("output dir", "")
+        if not isinstance(outputDir, str):
+            raise ValueError("\"output dir\" must be a path inside the service's output directory")
+        serviceDir = self.outputDir.resolve()
+        outputDir = (serviceDir / outputDir).resolve()
+        try:
+            outputDir.relative_to(serviceDir)
+        except ValueError:
+            raise ValueError("\"output dir\" must be a path inside the service's output directory")
+        
+        config, testPlan, loadedAt = self.loaded
+        try:
+            testNumbers = createTests(config, numberOfTests, outputDir, seed, workers=self.workers, writeFiles=not request.get("manifest only", False), compileSettings=self.compileSettings, outputMode=outputMode, avoidVersions=avoidVersions, testPlan=testPlan)
+        except SystemExit:
+            return 500, {"error":"could not make the tests, see the service's output for why"}
+        except OSError as e:
+            return 500, {"error":"could not make the tests: " + str(e)}
+        except CompileError as e:
+            return 500, {"error":"the tests were made but some failed to compile", "versions":e.testNumbers, "failed files":e.failedFiles, "output dir":str(outputDir)}
+        return 200, {"versions":testNumbers, "output dir":str(outputDir)}
 
-        #decide what file to use and then write out
-        #probably more efficient to just walk the directory and find the name but yolo
-        testNumber = 1
-        while (OUTPUT_DIR_PATH / ("test_" + str(testNumber) + ".tex")).exists() or (OUTPUT_DIR_PATH / ("test_" + str(testNumber) + "_answers.tex")).exists():
-            testNumber += 1
+class GenerationRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers HTTP requests for the GenerationService in server.service:
+        GET /status = describes what is loaded
+        POST /tests = makes tests, given a JSON object as described in GenerationService.makeTests
+        POST /reload = reloads the configuration, headers and changed question files
+    Responses are JSON objects, with "error" set if something went wrong.
+    """
+    
+    def do_GET(self):
+        if self.path == "/status":
+            self.sendJson(200, self.server.service.status())
+        else:
+            self.sendJson(404, {"error":"no such page, try GET /status, POST /tests or POST /reload"})
+    
+    def do_POST(self):
+        #a request that goes wrong in an unexpected way still gets an answer, rather than a dropped connection
         try:
-            testTex = testTex.replace("%%VERSION_NUMBER%%", str(testNumber))
-            answerTex = answerTex.replace("%%VERSION_NUMBER%%", str(testNumber) + " ANSWER KEY")
-            (OUTPUT_DIR_PATH / ("test_" + str(testNumber) + ".tex")).write_text(testTex)
-            (OUTPUT_DIR_PATH / ("test_" + str(testNumber) + "_answers.tex")).write_text(answerTex)
-        except IOError as e:
-            print("ERROR: could not write out the test file, please check write permissions.")
-            waitAndExit(1)
-        print("Created 'test_" + str(testNumber) + ".tex' and 'test_" + str(testNumber) + "_answers.tex'")
+            if self.path == "/reload":
+                self.sendJson(*self.server.service.reload())
+            elif self.path == "/tests":
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    if not isinstance(request, dict):
+                        raise ValueError("the request must be a JSON object")
+                    response = self.server.service.makeTests(request)
+                except ValueError as e:
+                    response = (400, {"error":str(e)})
+                self.sendJson(*response)
+            else:
+                self.sendJson(404, {"error":"no such page, try GET /status, POST /tests or POST /reload"})
+        except Exception:
+            self.log_error("unexpected error answering %s", self.path)
+            traceback.print_exc()
+            self.sendJson(500, {"error":"something went wrong, see the service's output for why"})
+    
+    def sendJson(self, status, response):
+        """
+        Sends response as JSON with the given HTTP status.
+        """
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(service, port, host=SERVICE_HOST):
+    """
+    Loads the service's configuration and serves requests for it over HTTP until
+    interrupted.  Exits with an error message if the configuration can't be
+    loaded or the port can't be listened on.
+    
+    service = the GenerationService to serve
+    port = the port to listen on
+    host = the address to listen on; only this machine by default, since there is no authentication
+    """
+    service.load()
+    try:
+        server = http.server.ThreadingHTTPServer((host, port), GenerationRequestHandler)
+    except OSError as e:
+        print("ERROR: could not listen on " + host + ":" + str(port) + ": " + str(e))
+        waitAndExit(1)
+    server.service = service
+    print("Serving " + str(service.configPath) + " at http://" + host + ":" + str(port) + "/, press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def watchQuestionFiles(configPath, previewDir=None, seed=0, cachePath=QUESTION_CACHE_FILE_PATH, compileSettings=None):
+    """
+    Checks the configuration, headers and question files for changes every
+    WATCH_INTERVAL_SECONDS until interrupted.  Only the question files that
+    changed are parsed again, and only the sets using them are checked for
+    having enough questions, unless the configuration or headers changed.
+    Problems are printed and watching carries on.
+    
+    configPath = path to the configuration file
+    previewDir = directory to write a preview test and answer key into after every change, or None for no preview
+    seed = seed to choose the preview's questions with, kept the same so only edits change the preview
+    cachePath = path of the parsed question file cache, or None to not use one
+    compileSettings = settings for compileTests to compile the preview to PDF, or None to leave it as .tex
+    """
+    questionBank = QuestionBank(cachePath)
+    config = None
+    settingsStamps = None
+    unreadableStamps = {}
+    uncheckedSets = set()
+    print("Watching " + str(configPath) + " and its question files, press Ctrl+C to stop")
+    try:
+        while True:
+            #the configuration and headers are small, so any change to them means checking everything again
+            newSettingsStamps = [fileStamp(path) for path in (configPath, TEST_HEADER_FILE_PATH, ANSWER_KEY_HEADER_FILE_PATH)]
+            changedSets = None
+            if newSettingsStamps != settingsStamps:
+                settingsStamps = newSettingsStamps
+                uncheckedSets = set()
+                try:
+                    config = loadConfig(configPath)
+                except SystemExit:
+                    config = None
+                changedSets = range(0, len(config["question sets"])) if config is not None else None
+            if config is None:
+                time.sleep(WATCH_INTERVAL_SECONDS)
+                continue
+            
+            #files that aren't loaded, such as newly added ones, count as changed too, unless they couldn't be read and haven't changed since
+            changedKeys = set(questionBank.refresh())
+            filePaths = [questionFile["file path"] for questionSet in config["question sets"] for questionFile in questionSet["question files"]]
+            for filePath in filePaths:
+                key = QuestionBank.key(filePath)
+                if key not in questionBank.files and (key not in unreadableStamps or unreadableStamps[key] != fileStamp(key)):
+                    changedKeys.add(key)
+            if changedSets is None:
+                changedSets = [setIndex for setIndex, questionSet in enumerate(config["question sets"]) if any(QuestionBank.key(questionFile["file path"]) in changedKeys for questionFile in questionSet["question files"])]
+            if changedSets:
+                #a file that is missing or unreadable is most likely half saved, so its sets are checked once it changes again
+                unreadableStamps = {}
+                uncheckedSets.update(changedSets)
+                for filePath in filePaths:
+                    try:
+                        questionBank.load([filePath])
+                    except SystemExit:
+                        unreadableStamps[QuestionBank.key(filePath)] = fileStamp(filePath)
+                questionBank.saveCache()
+                if not unreadableStamps:
+                    try:
+                        checkChangedQuestionSets(config, questionBank, sorted(uncheckedSets), previewDir, seed, compileSettings)
+                    except SystemExit:
+                        pass
+                    uncheckedSets = set()
+                print(DIVIDER)
+            time.sleep(WATCH_INTERVAL_SECONDS)
+    except KeyboardInterrupt:
+        print("")
+
+def fileStamp(path):
+    """
+    Returns the size and modification time of a file, or None if it doesn't exist.
+    """
+    try:
+        fileStat = os.stat(path)
+    except OSError:
+        return None
+    return (fileStat.st_size, fileStat.st_mtime_ns)
+
+def checkChangedQuestionSets(config, questionBank, changedSets, previewDir, seed, compileSettings):
+    """
+    Checks that the changed question sets have enough questions and, if every set
+    does, writes the preview.  Exits with an error message if the headers or
+    preview can't be read or written.
+    
+    config = config file for the program
+    questionBank = QuestionBank with all of the configuration's question files loaded
+    changedSets = the indices of the sets to check
+    previewDir = directory to write the preview into, or None for no preview
+    seed = seed to choose the preview's questions with
+    compileSettings = settings for compileTests to compile the preview to PDF, or None to leave it as .tex
+    """
+    insufficientSets = findInsufficientQuestionSets(config, questionBank, changedSets)
+    printInsufficientQuestionSets(config, insufficientSets)
+    print("Checked " + str(len(changedSets)) + " of " + str(len(config["question sets"])) + " question sets, " + str(len(changedSets) - len(insufficientSets)) + " have enough questions")
+    
+    #a changed set can leave too few questions for the other sets sharing them, so those are checked together
+    overcommittedSets = [] if insufficientSets else findOvercommittedQuestionSets(config, questionBank)
+    printOvercommittedQuestionSets(overcommittedSets)
+    if previewDir is None:
+        return
+    
+    #sets that weren't checked this time may still be short from an earlier change
+    if overcommittedSets or findInsufficientQuestionSets(config, questionBank):
+        print("Not updating the preview until every set has enough questions")
+        return
+    testPlan = TestPlan(config, questionBank, *readHeaders())
+    previewNames = (PREVIEW_FILE_NAME + ".tex", PREVIEW_FILE_NAME + ANSWER_KEY_FILE_SUFFIX)
+    try:
+        previewDir.mkdir(exist_ok=True)
+        with open(previewDir / previewNames[0], "w") as testOut, open(previewDir / previewNames[1], "w") as answerOut:
+            renderVersion(testPlan, PREVIEW_FILE_NAME.upper(), testPlan.sample(random.Random(seed)), testOut, answerOut)
+    except IOError:
+        print("ERROR: could not write the preview in " + str(previewDir) + ", please check write permissions.")
+        waitAndExit(1)
+    print("Updated '" + previewNames[0] + "' and '" + previewNames[1] + "'")
+    if compileSettings is not None:
+        compileTests(testPlan, previewDir, previewNames, compileSettings)
 
 def promptUserChoice(description, choices):
     """
@@ -529,32 +3383,184 @@ def saveConfig(config):
         config = json.dump(config, fout, indent=4)
     
 
-#################################################
-# Script start
-#################################################
-#change to the directory that the script lives in
-os.chdir(sys.path[0])
+def main(argv=None):
+    """
+    Entry point when run as a script.  With no arguments the interactive menu
+    is shown; passing --tests makes the tests without any prompts, which is
+    what scheduled jobs should use.
+    
+    argv = command line arguments, defaults to sys.argv[1:]
+    """
+    global INTERACTIVE, CONFIG_FILE_PATH
+    
+    parser = argparse.ArgumentParser(description="Generate random gateway tests as .tex files.  Runs the interactive menu unless --tests is given.")
+    parser.add_argument("--config", help="path to the configuration file (default: " + str(CONFIG_FILE_PATH) + ")")
+    parser.add_argument("--tests", type=int, help="number of tests to create without showing the menu")
+    parser.add_argument("--catalog", metavar="PATH", help="make tests for every configuration listed in a catalog file, without showing the menu")
+    parser.add_argument("--output-dir", help="directory to write the tests into (default: " + str(OUTPUT_DIR_PATH) + ")")
+    parser.add_argument("--seed", type=int, help="seed for the random number generator, to make a batch reproducible")
+    parser.add_argument("--output-mode", choices=[OUTPUT_MODE_FILES, OUTPUT_MODE_COMBINED, OUTPUT_MODE_ARCHIVE], default=OUTPUT_MODE_FILES, help="'" + OUTPUT_MODE_FILES + "' writes each test to its own files, '" + OUTPUT_MODE_COMBINED + "' writes the whole batch into one test document and one answer key document, '" + OUTPUT_MODE_ARCHIVE + "' writes the whole batch into one zip archive (default: " + OUTPUT_MODE_FILES + ")")
+    parser.add_argument("--list-archive", metavar="ARCHIVE", help="list the versions in an archive made with --output-mode " + OUTPUT_MODE_ARCHIVE)
+    parser.add_argument("--extract", nargs=2, metavar=("ARCHIVE", "VERSION"), help="extract one version from an archive made with --output-mode " + OUTPUT_MODE_ARCHIVE + " into the output directory")
+    parser.add_argument("--avoid", metavar="VERSIONS", help="choose questions that overlap as little as possible with the rest of the batch and with these earlier versions from the manifest: a comma separated list of version numbers, '" + AVOID_ALL_VERSIONS + "' for every version, or 'none' for just the rest of the batch")
+    parser.add_argument("--manifest-only", action="store_true", help="only record the tests in the output directory's manifest, without writing their files")
+    parser.add_argument("--regenerate", type=int, metavar="VERSION", help="make a version recorded in the output directory's manifest again")
+    parser.add_argument("--compile", action="store_true", help="compile the tests to PDF after making them")
+    parser.add_argument("--latex-command", help="command to compile each test with, implies --compile.  {file} is replaced with the .tex file and {format} with the precompiled header format (default: " + LATEX_COMMAND + ")")
+    parser.add_argument("--latex-format-command", help="command to precompile the header into a format with (default: " + LATEX_FORMAT_COMMAND + ")")
+    parser.add_argument("--compile-workers", type=int, help="number of compiles to run at once (default: number of CPUs)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to make tests with (default: 1)")
+    parser.add_argument("--batch-select", action="store_true", help="choose the questions for the whole batch at once, which is faster for very large batches; needs NumPy")
+    parser.add_argument("--pipeline", action="store_true", help="write the tests to disk from a background thread while the next ones are made, flushing them to disk in batches")
+    parser.add_argument("--simulate", type=int, metavar="TESTS", help="simulate choosing questions for TESTS tests without making any, and report how often each question and file is used and how much tests overlap; needs NumPy")
+    parser.add_argument("--simulation-json", metavar="PATH", help="with --simulate, also save the full report as JSON to PATH")
+    parser.add_argument("--stats", action="store_true", help="print how long each stage took and counters such as files read and bytes written")
+    parser.add_argument("--stats-json", metavar="PATH", help="save the timings and counters as JSON to PATH")
+    parser.add_argument("--profile", metavar="PATH", help="save cProfile statistics for the run to PATH")
+    parser.add_argument("--compact", action="store_true", help="for very large question files: read questions straight from the files as they are chosen, instead of loading them all into memory")
+    parser.add_argument("--no-cache", action="store_true", help="parse every question file instead of using the parsed question cache")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="keep the configuration and question files loaded and make tests on request over HTTP at PORT")
+    parser.add_argument("--watch", action="store_true", help="keep checking the configuration and question files as they are edited, until stopped with Ctrl+C")
+    parser.add_argument("--preview", action="store_true", help="with --watch, write '" + PREVIEW_FILE_NAME + ".tex' and its answer key into the output directory after every change, using --seed")
+    parser.add_argument("--host", default=SERVICE_HOST, help="address for --serve to listen on (default: " + SERVICE_HOST + ", only this machine)")
+    args = parser.parse_args(argv)
+    
+    #paths given on the command line are relative to where the user ran us, not where the script lives
+    configPath = pathlib.Path(args.config).resolve() if args.config else CONFIG_FILE_PATH
+    statsJsonPath = pathlib.Path(args.stats_json).resolve() if args.stats_json else None
+    profilePath = pathlib.Path(args.profile).resolve() if args.profile else None
+    outputDir = pathlib.Path(args.output_dir).resolve() if args.output_dir else OUTPUT_DIR_PATH
+    archivePath = pathlib.Path(args.list_archive or args.extract[0]).resolve() if args.list_archive or args.extract else None
+    catalogPath = pathlib.Path(args.catalog).resolve() if args.catalog else None
+    simulationJsonPath = pathlib.Path(args.simulation_json).resolve() if args.simulation_json else None
+    
+    #change to the directory that the script lives in
+    os.chdir(pathlib.Path(__file__).resolve().parent)
+    
+    #archives don't need the configuration at all
+    if args.list_archive is not None:
+        try:
+            print(", ".join(str(testNumber) for testNumber in listArchivedVersions(archivePath)))
+        except (IOError, zipfile.BadZipFile):
+            print("ERROR: could not read the archive at " + str(archivePath))
+            waitAndExit(1)
+        return
+    if args.extract is not None:
+        testNumber = args.extract[1]
+        try:
+            extractArchivedVersion(archivePath, int(testNumber), outputDir)
+        except ValueError:
+            parser.error("VERSION must be a number")
+        except KeyError:
+            print("ERROR: version " + testNumber + " is not in the archive at " + str(archivePath))
+            waitAndExit(1)
+        except (IOError, zipfile.BadZipFile):
+            print("ERROR: could not extract from the archive at " + str(archivePath))
+            waitAndExit(1)
+        print("Extracted 'test_" + testNumber + ".tex' and 'test_" + testNumber + "_answers.tex'")
+        return
+    
+    #headless runs
+    cachePath = None if args.no_cache else QUESTION_CACHE_FILE_PATH
+    compileSettings = None
+    if args.compile or args.latex_command:
+        compileSettings = {"command":args.latex_command, "format command":args.latex_format_command, "workers":args.compile_workers}
+    avoidVersions = None
+    if args.avoid is not None:
+        if args.avoid == AVOID_ALL_VERSIONS:
+            avoidVersions = AVOID_ALL_VERSIONS
+        elif args.avoid == "none":
+            avoidVersions = []
+        else:
+            try:
+                avoidVersions = [int(token.strip()) for token in args.avoid.split(",")]
+            except ValueError:
+                parser.error("--avoid must be '" + AVOID_ALL_VERSIONS + "', 'none' or a comma separated list of version numbers")
+    if args.watch:
+        watchQuestionFiles(configPath, outputDir if args.preview else None, args.seed or 0, cachePath, compileSettings)
+        return
+    if args.batch_select and numpy is None:
+        parser.error("--batch-select needs NumPy, which isn't installed")
+    if args.simulate is not None:
+        if numpy is None:
+            parser.error("--simulate needs NumPy, which isn't installed")
+        if args.simulate < 2:
+            parser.error("--simulate must be at least 2")
+        config = loadConfig(configPath)
+        testPlan = loadTestPlan(config, cachePath, CompactQuestionBank() if args.compact else None)
+        report = simulateExposure(config, testPlan, args.simulate, args.seed)
+        printExposureReport(report)
+        if simulationJsonPath is not None:
+            with open(simulationJsonPath, "w") as fout:
+                json.dump(report, fout, indent=4)
+            print("Saved the report to " + str(simulationJsonPath))
+        return
+    if args.serve is not None:
+        serve(GenerationService(configPath, outputDir, cachePath, args.workers, compileSettings), args.serve, args.host)
+        return
+    if args.regenerate is not None or args.tests is not None or catalogPath is not None:
+        if args.tests is not None and args.tests < 1:
+            parser.error("--tests must be at least 1")
+        
+        #instrumentation is only switched on when asked for, since it changes how tests are written to time them
+        instrumentation = None
+        if args.stats or statsJsonPath is not None or profilePath is not None:
+            instrumentation = Instrumentation(profilePath)
+        compileError = None
+        writeError = None
+        with instrumentation or contextlib.nullcontext():
+            try:
+                if catalogPath is not None:
+                    runCatalog(catalogPath, cachePath, args.seed, args.workers, compileSettings, args.output_mode, avoidVersions, args.pipeline, args.batch_select, args.compact)
+                elif args.regenerate is not None:
+                    config = loadConfig(configPath)
+                    testPlan = loadTestPlan(config, questionBank=CompactQuestionBank()) if args.compact else None
+                    regenerateVersion(config, outputDir, args.regenerate, cachePath, compileSettings, testPlan)
+                else:
+                    config = loadConfig(configPath)
+                    testPlan = loadTestPlan(config, questionBank=CompactQuestionBank()) if args.compact else None
+                    createTests(config, args.tests, outputDir, args.seed, cachePath, args.workers, not args.manifest_only, compileSettings, args.output_mode, avoidVersions, testPlan, args.pipeline, args.batch_select)
+            except CompileError as e:
+                compileError = e
+            except IOError as e:
+                writeError = e
+        
+        if instrumentation is not None:
+            if args.stats:
+                print(DIVIDER)
+                instrumentation.printSummary()
+            if statsJsonPath is not None:
+                instrumentation.saveReport(statsJsonPath)
+        
+        if writeError is not None:
+            print("ERROR: could not write out the test file, please check write permissions.")
+            print("\t" + str(writeError))
+            waitAndExit(1)
+        
+        #scheduled jobs need to see that the tests weren't all compiled
+        if compileError is not None:
+            print("ERROR: " + str(compileError))
+            waitAndExit(1)
+        return
+    
+    #the menu saves its edits back to whatever file it loaded
+    INTERACTIVE = True
+    CONFIG_FILE_PATH = configPath
+    config = loadConfig(configPath)
+    
+    #welcome the user - this may seem silly, but my users are generally used to graphical interfaces
+    print(TITLE)
+    print(DIVIDER)
 
-#read the config file
-config = None
-try:
-    with open(CONFIG_FILE_PATH, "r") as fin:
-        config = json.load(fin)
-except IOError:
-    print("ERROR: The configuration file at " + str(CONFIG_FILE_PATH) + " could not be read.")
-    waitAndExit(1)
-except json.decoder.JSONDecodeError as e:
-    print("ERROR: Configuration file has an error on line " + str(e.lineno) + ".  Check that the file is valid JSON.")
-    waitAndExit(1)
-    
-#welcome the user - this may seem silly, but my users are generally used to graphical interfaces
-print(TITLE)
-print(DIVIDER)
-
-#start the menu
-try:
-    displayMainMenu(config)
-except KeyboardInterrupt:
-    print("") #its overwhelmingly probable they exit at an "input(...)", so newline to move the terminal cursor
+    #start the menu
+    try:
+        displayMainMenu(config)
+    except KeyboardInterrupt:
+        print("") #its overwhelmingly probable they exit at an "input(...)", so newline to move the terminal cursor
 
 
+#################################################
+# Script start
+#################################################
+if __name__ == "__main__":
+    main()